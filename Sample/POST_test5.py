@@ -1,32 +1,24 @@
-import asyncio
+import argparse
 import asyncio
 import json
 from datetime import datetime
 # collections.defaultdict と socket は不要になったので削除
-from aiohttp import web, ClientSession # ClientSession をインポート
+from aiohttp import web
+
+from message_bus import create_bus
 
 # DataAggregator クラス全体を削除
 # AsyncUDPSender クラス全体を削除
 
-# チャットビューアアプリのURL
+# チャットビューアアプリのURL (既定のメッセージバス)
 CHAT_VIEWER_URL = "http://localhost:5001/api/message" # ポート番号を 27099 から 5001 に戻す
-
-async def send_to_chat_viewer(session, text):
-    """指定されたテキストをチャットビューアアプリにPOST送信する"""
-    payload = {'text': text}
-    try:
-        async with session.post(CHAT_VIEWER_URL, json=payload) as response:
-            if response.status == 200:
-                print(f"Successfully sent '{text}' to chat viewer.")
-            else:
-                print(f"Failed to send '{text}' to chat viewer. Status: {response.status}, Response: {await response.text()}")
-    except Exception as e:
-        print(f"Error sending message to chat viewer: {e}")
-
+# 同じサーバーでチャットビューアも提供する場合のバス
+IN_PROCESS_BUS_URL = "memory://chat"
 
 async def handle_post(request):
     print("[handle_post] Received request.") # ログ追加
     # aggregator = request.app['aggregator'] # aggregator は不要になったので削除
+    bus = request.app['bus']
     try:
         post_data = await request.read()
         print(f"[handle_post] Read request body: {len(post_data)} bytes.") # ログ追加
@@ -34,18 +26,16 @@ async def handle_post(request):
         print("[handle_post] Parsed JSON payload.") # ログ追加
 
         # イベントから必要な情報を抽出
-        async with ClientSession() as session: # リクエストごとにセッションを作成
-            for event in payload.get('events', []):
-                print(f"[handle_post] Processing event: type={event.get('type')}") # ログ追加
-                if event.get('type') == 'message' and event['message'].get('type') == 'text':
-                    text = event['message']['text']
-                    # timestamp はチャットビューア側で付与するためここでは不要
-                    # timestamp = event.get('timestamp', int(datetime.now().timestamp() * 1000))
-
-                    # チャットビューアアプリにテキストを送信 (非同期呼び出し)
-                    await send_to_chat_viewer(session, text)
+        for event in payload.get('events', []):
+            print(f"[handle_post] Processing event: type={event.get('type')}") # ログ追加
+            if event.get('type') == 'message' and event['message'].get('type') == 'text':
+                text = event['message']['text']
+                # timestamp はチャットビューア側で付与するためここでは不要
+                # timestamp = event.get('timestamp', int(datetime.now().timestamp() * 1000))
 
-                    print(f"Sent text to chat viewer: {text}")
+                # チャットビューアへの転送はバスに積むだけ (まとめて送るのはバス側)
+                bus.publish({'text': text})
+                print(f"Queued text for chat viewer: {text}")
 
     except json.JSONDecodeError:
         print("Invalid JSON payload received")
@@ -57,13 +47,33 @@ async def handle_post(request):
     # レスポンス送信
     return web.json_response({"status": "OK"})
 
-async def main(host='0.0.0.0', port=8081):
+async def main(host='0.0.0.0', port=8081, bus_url=CHAT_VIEWER_URL, with_viewer=False):
+    """with_viewer=True なら同じサーバーでチャットビューア (/, /events) も提供し、プロセス内のバスでつなぐ"""
     # aggregator と udp_sender の初期化を削除
 
     # aiohttpアプリケーションを作成
     app = web.Application()
     # app['aggregator'] = aggregator # aggregator は不要になったので削除
 
+    # チャットビューアへの転送に使うメッセージバス
+    if with_viewer:
+        from chat_viewer_app import setup_chat_viewer
+        bus = create_bus(IN_PROCESS_BUS_URL)
+        # バスの開始・停止のフックは setup_chat_viewer が登録する
+        setup_chat_viewer(app, bus)
+    else:
+        bus = create_bus(bus_url)
+
+        async def start_bus(app):
+            await bus.start()
+
+        async def stop_bus(app):
+            await bus.stop()
+
+        app.on_startup.append(start_bus)
+        app.on_cleanup.append(stop_bus)
+    app['bus'] = bus
+
     # POSTルートを追加
     app.router.add_post('/test', handle_post) # Nginxプロキシ用に/testパスでリッスン
 
@@ -90,8 +100,20 @@ async def main(host='0.0.0.0', port=8081):
         print("Server stopped.")
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="LINE Webhook receiver that forwards texts to the chat viewer")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--bus', default=CHAT_VIEWER_URL,
+                        help="チャットビューアへ送るバス (http://.../api/message または unix:///path/to.sock)")
+    parser.add_argument('--with-viewer', action='store_true',
+                        help="同じサーバーでチャットビューア (/ と /events) も提供し、HTTPを経由せずに渡す")
+    return parser.parse_args()
+
+
 if __name__ == '__main__':
+    args = parse_args()
     try:
-        asyncio.run(main())
+        asyncio.run(main(args.host, args.port, args.bus, args.with_viewer))
     except KeyboardInterrupt:
         print("Application terminated by user.")
@@ -1,44 +1,126 @@
+import argparse
 import asyncio
 import json
+import os
 from datetime import datetime
 from aiohttp import web
 import aiohttp_jinja2
 import jinja2
 
-# メッセージを保存するリスト (メモリ上)
-messages = []
-# SSE接続を保持するリスト
-sse_connections = []
+from message_bus import RecentIds, create_bus
+from message_store import MessageStore
+from page_cache import IndexPageCache
+from sse_registry import SSERegistry
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+# メッセージの履歴 (メモリ上、上限を超えた古いものから上書き)
+message_store = MessageStore()
+# トップページに最初から表示する件数と、/api/messages で一度に返す件数の上限
+INDEX_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# バスの再送で同じメッセージが2回届いても1回だけ表示するための既読ID
+received_ids = RecentIds()
+# SSE接続 (接続IDをキーに管理し、書き込めなくなった接続は自動で取り除く)
+sse_registry = SSERegistry()
+
+def etag_matches(if_none_match, etag):
+    return any(tag.strip() in (etag, '*') for tag in if_none_match.split(','))
+
+def accepts_gzip(accept_encoding):
+    """Accept-Encoding の q 値を見て gzip で返してよいか判定する (gzip;q=0 は不可)"""
+    qualities = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qualities[coding] = q
+    return qualities.get('gzip', qualities.get('*', 0.0)) > 0
 
 async def handle_index(request):
-    """ルートパス '/' でHTMLページを表示"""
-    context = {'messages': messages} # 現在のメッセージをテンプレートに渡す
-    response = aiohttp_jinja2.render_template('index.html', request, context)
-    return response
+    """ルートパス '/' でHTMLページを表示
+
+    最新の1ページ分だけを表示する (それより古いものは /api/messages で取得)。
+    レンダリング結果はメッセージが増えるまでキャッシュし、ETag が一致すれば 304 を返す。
+    """
+    page = request.app['index_cache'].get(message_store)
+    use_gzip = accepts_gzip(request.headers.get('Accept-Encoding', ''))
+    etag = page.gzip_etag if use_gzip else page.etag
+    # 圧縮するかどうかでレスポンスが変わるので、どちらの表現にも Vary を付ける
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+    if etag_matches(request.headers.get('If-None-Match', ''), etag):
+        return web.Response(status=304, headers=headers)
+    if use_gzip:
+        headers['Content-Encoding'] = 'gzip'
+        return web.Response(body=page.gzip_body, content_type='text/html', charset='utf-8', headers=headers)
+    return web.Response(body=page.body, content_type='text/html', charset='utf-8', headers=headers)
+
+async def handle_get_messages(request):
+    """'/api/messages?before=&limit=' で before より古いメッセージを新しい方から limit 件返す (古い順)"""
+    try:
+        before = int(request.query['before']) if request.query.get('before') else None
+        limit = int(request.query.get('limit', INDEX_PAGE_SIZE))
+    except ValueError:
+        return web.Response(status=400, text='{"error": "Invalid before or limit"}', content_type='application/json')
+    if limit < 1:
+        return web.Response(status=400, text='{"error": "Invalid before or limit"}', content_type='application/json')
+    page, next_before = message_store.page(before, min(limit, MAX_PAGE_SIZE))
+    return web.json_response({'messages': page, 'next_before': next_before})
+
+async def deliver_messages(texts):
+    """メッセージを保存し、全SSEクライアントに配信する (/api/message とメッセージバスの共通処理)"""
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    sse_frames = []
+    for text in texts:
+        new_message = message_store.add(text, timestamp)
+        sse_frames.append(f"data: {json.dumps(new_message)}\n\n")
+    print(f"Received {len(texts)} message(s): {texts}")
+
+    # 新しいメッセージを全SSEクライアントに送信 (バッチ分をまとめて1回で書き込む)
+    await sse_registry.broadcast(''.join(sse_frames).encode('utf-8'))
+
+def is_new_message(message):
+    """'id' の付いたメッセージは初めて届いたものだけ True (id がなければ常に True)"""
+    message_id = message.get('id')
+    return not isinstance(message_id, str) or received_ids.add(message_id)
+
+async def handle_bus_messages(batch):
+    """メッセージバスから届いたメッセージ ({'text': ...} のリスト) を配信する"""
+    texts = [message['text'] for message in batch
+             if isinstance(message.get('text'), str) and message['text'] and is_new_message(message)]
+    if texts:
+        await deliver_messages(texts)
 
 async def handle_post_message(request):
-    """'/api/message' でPOSTリクエストを受け取り、メッセージを保存・配信"""
+    """'/api/message' でPOSTリクエストを受け取り、メッセージを保存・配信
+
+    1件なら {"text": ...}、まとめて送る場合は {"messages": [{"text": ...}, ...]} を受け付ける。
+    "id" の付いたメッセージは、再送で同じ id が届いても1回だけ保存・配信する。
+    """
     try:
         data = await request.json()
-        text = data.get('text')
-        if not text:
+        items = data.get('messages') if isinstance(data, dict) and 'messages' in data else [data]
+        if not isinstance(items, list) or not items:
+            return web.Response(status=400, text='{"error": "Invalid messages field"}', content_type='application/json')
+        texts = [item.get('text') if isinstance(item, dict) else None for item in items]
+        if not all(texts):
             return web.Response(status=400, text='{"error": "Missing text field"}', content_type='application/json')
+        if not all(isinstance(text, str) for text in texts):
+            return web.Response(status=400, text='{"error": "text must be a string"}', content_type='application/json')
 
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        new_message = {'text': text, 'timestamp': timestamp}
-        messages.append(new_message)
-        print(f"Received message: {new_message}")
-
-        # 新しいメッセージを全SSEクライアントに送信
-        sse_data = f"data: {json.dumps(new_message)}\n\n"
-        for resp in sse_connections:
-            try:
-                await resp.write(sse_data.encode('utf-8'))
-            except Exception as e:
-                print(f"Error sending to SSE client: {e}")
-                # エラーが発生した接続はリストから削除することも検討
-
-        return web.json_response({"status": "OK"})
+        new_texts = [text for item, text in zip(items, texts) if is_new_message(item)]
+        if new_texts:
+            await deliver_messages(new_texts)
+        return web.json_response({"status": "OK", "received": len(texts), "duplicates": len(texts) - len(new_texts)})
 
     except json.JSONDecodeError:
         return web.Response(status=400, text='{"error": "Invalid JSON"}', content_type='application/json')
@@ -55,42 +137,70 @@ async def handle_events(request):
                  'Cache-Control': 'no-cache',
                  'Connection': 'keep-alive'}
     )
-    await response.prepare(request)
-    sse_connections.append(response)
-    print(f"SSE client connected: {request.remote}")
+    conn = sse_registry.add(request, response)
+    if conn is None:
+        print(f"Rejecting SSE client {request.remote}: {len(sse_registry)} connections open")
+        return web.Response(status=503, text='{"error": "Too many connections"}', content_type='application/json',
+                            headers={'Retry-After': '10'})
+    print(f"SSE client connected: {request.remote} (id {conn.id}, {len(sse_registry)} open)")
 
     try:
-        # 接続維持のため、定期的にコメントを送信するか、
-        # またはクライアントが切断するまで待機
-        while True:
-            # 必要であれば、ここでキープアライブコメントを送信
-            # await response.write(b': keepalive\n\n')
-            await asyncio.sleep(60) # 60秒ごとにチェック or キープアライブ
-            # クライアントが切断したかどうかのチェックはaiohttpが内部で行う
-            # 書き込み時にエラーが発生したら切断とみなせる
-
+        await response.prepare(request)
+        # 切断の検出は配信とキープアライブの書き込みで行い、検出したら closed が set される
+        await conn.closed.wait()
     except asyncio.CancelledError:
         print("SSE handler cancelled.")
-        # raise # キャンセルを伝播させる場合
     except Exception as e:
         print(f"Error in SSE connection: {e}")
     finally:
-        # クライアント切断時やエラー時にリストから削除
-        if response in sse_connections:
-            sse_connections.remove(response)
-        print(f"SSE client disconnected: {request.remote}")
+        sse_registry.remove(conn.id)
+        print(f"SSE client disconnected: {request.remote} (id {conn.id})")
 
     return response
 
-async def main(host='0.0.0.0', port=5001): # ポート番号を 27099 から 5001 に戻す
-    app = web.Application()
+def setup_chat_viewer(app, bus=None):
+    """チャットビューアのルートを app に追加する
+
+    bus を渡すと、そのメッセージバスに届いたメッセージも配信する
+    (POST_test5.py と同じサーバーで動かす場合は memory:// のバスを共有する)。
+    """
     # Jinja2テンプレートの設定
-    aiohttp_jinja2.setup(app, loader=jinja2.FileSystemLoader('templates'))
+    env = aiohttp_jinja2.setup(app, loader=jinja2.FileSystemLoader(TEMPLATES_DIR))
+    app['index_cache'] = IndexPageCache(env.get_template('index.html'), INDEX_PAGE_SIZE)
 
     app.router.add_get('/', handle_index)
     app.router.add_post('/api/message', handle_post_message)
+    app.router.add_get('/api/messages', handle_get_messages)
     app.router.add_get('/events', handle_events)
 
+    async def start_sse(app):
+        await sse_registry.start()
+
+    async def stop_sse(app):
+        await sse_registry.stop()
+
+    app.on_startup.append(start_sse)
+    app.on_cleanup.append(stop_sse)
+
+    if bus is not None:
+        bus.subscribe(handle_bus_messages)
+
+        async def start_bus(app):
+            await bus.start()
+
+        async def stop_bus(app):
+            await bus.stop()
+
+        app.on_startup.append(start_bus)
+        app.on_cleanup.append(stop_bus)
+
+async def main(host='0.0.0.0', port=5001, bus_url=None, history_size=1000, max_connections=1000): # ポート番号を 27099 から 5001 に戻す
+    global message_store, sse_registry
+    message_store = MessageStore(history_size)
+    sse_registry = SSERegistry(max_connections)
+    app = web.Application()
+    setup_chat_viewer(app, create_bus(bus_url) if bus_url else None)
+
     runner = web.AppRunner(app)
     await runner.setup()
     site = web.TCPSite(runner, host, port)
@@ -106,8 +216,18 @@ async def main(host='0.0.0.0', port=5001): # ポート番号を 27099 から 500
         await runner.cleanup()
         print("Chat Viewer server stopped.")
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Real-time chat viewer")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--history-size', type=int, default=1000, help="保持するメッセージの件数")
+    parser.add_argument('--max-connections', type=int, default=1000, help="SSE接続数の上限 (超えたら 503 を返す)")
+    parser.add_argument('--bus', help="/api/message に加えてメッセージを受け取るバス (例: unix:///tmp/chat_viewer.sock)")
+    return parser.parse_args()
+
 if __name__ == '__main__':
+    args = parse_args()
     try:
-        asyncio.run(main())
+        asyncio.run(main(args.host, args.port, args.bus, args.history_size, args.max_connections))
     except KeyboardInterrupt:
         print("Chat Viewer application terminated by user.")
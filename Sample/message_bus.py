@@ -0,0 +1,296 @@
+"""Webhook受信側からチャットビューアへメッセージを届けるメッセージバス
+
+バックエンドはURLで選ぶ。
+
+    http://localhost:5001/api/message   従来通りチャットビューアの /api/message にPOSTする (送信のみ)
+    memory://chat                        同じプロセス内で直接ハンドラを呼ぶ (/test と /events を1つのサーバーで提供する場合)
+    unix:///tmp/chat_viewer.sock         Unixドメインソケットで別プロセスに送る
+
+メッセージは {'text': ...} の辞書で、publish() は待たずにバッファに積むだけ。
+購読側のハンドラにはメッセージのリストがまとめて渡される。
+失敗したバッチを再送するバス (http / unix) は各メッセージに 'id' を付けるので、
+受信側は RecentIds で重複を取り除く (届いていたのに応答がタイムアウトした場合の再送対策)。
+"""
+import asyncio
+import itertools
+import json
+import os
+import struct
+from collections import deque
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+
+# Unixドメインソケットのフレーム: 4バイトの長さ + JSON (メッセージのリスト)
+FRAME_HEADER = struct.Struct('>I')
+
+
+class RecentIds:
+    """最近受け取ったメッセージIDを上限付きで覚えておく"""
+
+    def __init__(self, capacity=10000):
+        self._order = deque()
+        self._ids = set()
+        self.capacity = capacity
+
+    def add(self, message_id):
+        """初めて見たIDなら覚えて True、既に受け取っていれば False を返す"""
+        if message_id in self._ids:
+            return False
+        if len(self._order) >= self.capacity:
+            self._ids.discard(self._order.popleft())
+        self._order.append(message_id)
+        self._ids.add(message_id)
+        return True
+
+
+class MessageBus:
+    """publish() で積んだメッセージを subscribe() したハンドラに届ける"""
+
+    def __init__(self):
+        self.handlers = []
+
+    def subscribe(self, handler):
+        """handler(messages) はメッセージのリストを受け取るコルーチン関数"""
+        self.handlers.append(handler)
+
+    def publish(self, message):
+        raise NotImplementedError
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def _dispatch(self, messages):
+        for handler in self.handlers:
+            try:
+                await handler(messages)
+            except Exception as e:
+                print(f"Error in message bus handler: {e}")
+
+
+class BatchingBus(MessageBus):
+    """送信をまとめて行うバスの共通部分
+
+    flush_interval 秒ごと、または max_batch 件たまるごとに _send() でまとめて送る。
+    送信に失敗したバッチは上限付きのバッファの先頭に戻して再送する (溢れた分は古いものから捨てる)。
+    """
+
+    def __init__(self, flush_interval=0.02, max_batch=100, max_buffer=10000, retry_delay=1.0):
+        super().__init__()
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.retry_delay = retry_delay
+        self.buffer = deque(maxlen=max_buffer)
+        # 再送しても受信側で同じメッセージだと分かるよう、バスごとのランダムな接頭辞 + 連番のIDを付ける
+        self._id_prefix = os.urandom(4).hex()
+        self._ids = itertools.count(1)
+        self._task = None
+        self._full = asyncio.Event()
+        # 統計
+        self.sent = 0
+        self.failed_batches = 0
+        self.dropped = 0
+
+    def publish(self, message):
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        if 'id' not in message:
+            message = {**message, 'id': f"{self._id_prefix}-{next(self._ids)}"}
+        self.buffer.append(message)
+        if len(self.buffer) >= self.max_batch:
+            self._full.set()
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # 残っている分を送ってから止める
+        while self.buffer and await self._flush():
+            pass
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            while self.buffer:
+                if not await self._flush():
+                    await asyncio.sleep(self.retry_delay)
+                    break
+
+    async def _flush(self):
+        """バッファの先頭から最大 max_batch 件を送る。失敗したら戻して False を返す"""
+        batch = [self.buffer.popleft() for _ in range(min(self.max_batch, len(self.buffer)))]
+        try:
+            await self._send(batch)
+            self.sent += len(batch)
+            return True
+        except asyncio.CancelledError:
+            # 停止中に送信が中断された場合も捨てずに戻す (届いていても受信側が id で重複を除く)
+            self._requeue(batch)
+            raise
+        except Exception as e:
+            print(f"Error sending {len(batch)} messages over {type(self).__name__}: {e}")
+        self.failed_batches += 1
+        self._requeue(batch)
+        return False
+
+    def _requeue(self, batch):
+        """送れなかった分を順番を保ったまま先頭に戻す (入りきらない分は捨てる)"""
+        room = self.buffer.maxlen - len(self.buffer)
+        if room < len(batch):
+            self.dropped += len(batch) - room
+            batch = batch[len(batch) - room:] if room else []
+        self.buffer.extendleft(reversed(batch))
+
+    async def _send(self, batch):
+        raise NotImplementedError
+
+
+class HttpBus(BatchingBus):
+    """チャットビューアの /api/message に {'messages': [...]} をPOSTする (送信のみ)
+
+    起動中は1つの ClientSession (コネクションプール) を使い回す。
+    チャットビューアは全SSEクライアントへの書き込み (1クライアントあたり最大 write_timeout 秒) を
+    待ってから応答するので、timeout はそれより十分長くしておく。
+    """
+
+    def __init__(self, url, timeout=15.0, **kwargs):
+        super().__init__(**kwargs)
+        self.url = url
+        self.timeout = timeout
+        self.session = None
+
+    def subscribe(self, handler):
+        raise NotImplementedError("HttpBus is publish-only; the receiver is the /api/message endpoint")
+
+    async def start(self):
+        # 同じチャットビューアへの接続を保持して使い回す
+        connector = TCPConnector(limit=4, keepalive_timeout=60)
+        self.session = ClientSession(connector=connector, timeout=ClientTimeout(total=self.timeout))
+        await super().start()
+
+    async def stop(self):
+        await super().stop()
+        if self.session is not None:
+            await self.session.close()
+
+    async def _send(self, batch):
+        async with self.session.post(self.url, json={'messages': batch}) as response:
+            if response.status != 200:
+                raise RuntimeError(f"status {response.status}: {await response.text()}")
+
+
+class InProcessBus(MessageBus):
+    """同じプロセス内のハンドラに直接渡す (エンコードもHTTPもしない)
+
+    同じイベントループの周回で publish されたメッセージは1回の呼び出しにまとめる。
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._pending = []
+        self._tasks = set()
+
+    def publish(self, message):
+        if not self._pending:
+            asyncio.get_running_loop().call_soon(self._deliver)
+        self._pending.append(message)
+
+    def _deliver(self):
+        messages, self._pending = self._pending, []
+        task = asyncio.create_task(self._dispatch(messages))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def stop(self):
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+class UnixSocketBus(BatchingBus):
+    """Unixドメインソケットで別プロセスに送る
+
+    subscribe() したハンドラがあれば start() でソケットを待ち受け (受信側)、
+    publish() されたメッセージは接続を保ったまま長さ付きのJSONフレームで送る (送信側)。
+    """
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._server = None
+        self._writer = None
+
+    async def start(self):
+        if self.handlers:
+            # 前回の異常終了で残ったソケットファイルを消してから待ち受ける
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            self._server = await asyncio.start_unix_server(self._serve, path=self.path)
+            print(f"Message bus listening on unix:{self.path}")
+        await super().start()
+
+    async def stop(self):
+        await super().stop()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                header = await reader.readexactly(FRAME_HEADER.size)
+                (length,) = FRAME_HEADER.unpack(header)
+                messages = json.loads(await reader.readexactly(length))
+                await self._dispatch(messages)
+        except asyncio.IncompleteReadError:
+            pass
+        except Exception as e:
+            print(f"Error reading from message bus connection: {e}")
+        finally:
+            writer.close()
+
+    async def _send(self, batch):
+        if self._writer is None or self._writer.is_closing():
+            _reader, self._writer = await asyncio.open_unix_connection(self.path)
+        body = json.dumps(batch, ensure_ascii=False).encode('utf-8')
+        try:
+            self._writer.write(FRAME_HEADER.pack(len(body)) + body)
+            await self._writer.drain()
+        except Exception:
+            # 次回はつなぎ直す
+            self._writer.close()
+            self._writer = None
+            raise
+
+
+# memory:// のバスは名前ごとにプロセス内で1つだけ作り、送信側と受信側で共有する
+_in_process_buses = {}
+
+
+def create_bus(url, **kwargs):
+    """URLのスキームに応じたバックエンドのバスを作る"""
+    if url.startswith(('http://', 'https://')):
+        return HttpBus(url, **kwargs)
+    if url.startswith('memory://'):
+        name = url[len('memory://'):]
+        if name not in _in_process_buses:
+            _in_process_buses[name] = InProcessBus()
+        return _in_process_buses[name]
+    if url.startswith('unix://'):
+        return UnixSocketBus(url[len('unix://'):], **kwargs)
+    raise ValueError(f"Unknown message bus URL: {url}")
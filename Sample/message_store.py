@@ -0,0 +1,42 @@
+"""チャットビューアのメッセージ履歴 (固定長のリングバッファ)
+
+メッセージには1から連番のIDを振る。IDが連続しているので、ID から
+リング上の位置が直接求まり、ページの取り出しは件数分の O(limit) で済む。
+容量を超えた古いメッセージは上書きされる。
+"""
+
+
+class MessageStore:
+    def __init__(self, capacity=1000):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self._ring = [None] * capacity
+        self.next_id = 1
+
+    def __len__(self):
+        return min(self.next_id - 1, self.capacity)
+
+    @property
+    def first_id(self):
+        """まだ残っている一番古いメッセージのID"""
+        return max(1, self.next_id - self.capacity)
+
+    def add(self, text, timestamp):
+        message = {'id': self.next_id, 'text': text, 'timestamp': timestamp}
+        self._ring[self.next_id % self.capacity] = message
+        self.next_id += 1
+        return message
+
+    def page(self, before=None, limit=50):
+        """ID が before より小さいメッセージのうち新しい方から limit 件を古い順で返す
+
+        戻り値は (メッセージのリスト, 次のページの before。これより古いものがなければ None)。
+        """
+        end = self.next_id if before is None else max(self.first_id, min(before, self.next_id))
+        start = max(self.first_id, end - limit)
+        page = [self._ring[i % self.capacity] for i in range(start, end)]
+        return page, (start if start > self.first_id else None)
+
+    def latest(self, limit=50):
+        return self.page(None, limit)[0]
@@ -0,0 +1,70 @@
+"""チャットビューアのトップページ ('/') のレンダリング結果のキャッシュ
+
+メッセージ1件ごとのHTML断片はエスケープ済みの状態で1回だけ作り、
+ページ全体のバイト列 (とそのgzip版) はメッセージが増えるまで使い回す。
+メッセージが増えたかどうかは MessageStore.next_id で判定するので、
+追加側から明示的に無効化を呼ぶ必要はない。
+"""
+import gzip
+import os
+
+from markupsafe import Markup, escape
+
+
+def render_fragment(message):
+    """メッセージ1件分のHTML (templates/index.html の .message と同じ構造)"""
+    return (
+        '<div class="message">'
+        f'<span>{escape(message["text"])}</span>'
+        f'<span class="timestamp">{escape(message["timestamp"])}</span>'
+        '</div>\n'
+    )
+
+
+class CachedPage:
+    def __init__(self, etag, body):
+        self.etag = etag
+        # 表現ごとに別の強いETagを使う (同じ値だと圧縮前後の本文を取り違えられる)
+        self.gzip_etag = etag[:-1] + '-gzip"'
+        self.body = body
+        self._gzip_body = None
+
+    @property
+    def gzip_body(self):
+        # gzip を受け付けるクライアントが来たときに1回だけ圧縮する
+        if self._gzip_body is None:
+            self._gzip_body = gzip.compress(self.body, compresslevel=6)
+        return self._gzip_body
+
+
+class IndexPageCache:
+    def __init__(self, template, page_size):
+        self.template = template
+        self.page_size = page_size
+        # プロセスごとに変わる値を ETag に含め、再起動後に古い 304 を返さないようにする
+        self._nonce = os.urandom(4).hex()
+        self._fragments = {}
+        self._page = None
+        self._version = None
+        # 統計
+        self.renders = 0
+
+    def get(self, store):
+        """store の最新ページを返す (前回から変わっていなければキャッシュをそのまま返す)"""
+        version = (id(store), store.next_id)
+        if self._page is None or self._version != version:
+            self._page = self._render(store)
+            self._version = version
+        return self._page
+
+    def _render(self, store):
+        messages, next_before = store.page(None, self.page_size)
+        fragments = {}
+        for message in messages:
+            fragment = self._fragments.get(message['id'])
+            fragments[message['id']] = fragment if fragment is not None else render_fragment(message)
+        # ページから外れた断片は捨てる
+        self._fragments = fragments
+        body = self.template.render(messages_html=Markup(''.join(fragments.values())), next_before=next_before)
+        self.renders += 1
+        return CachedPage(f'"{self._nonce}-{store.next_id}"', body.encode('utf-8'))
@@ -0,0 +1,95 @@
+"""チャットビューアのSSE接続の管理
+
+接続は接続IDをキーにした辞書で持つので、追加・削除は O(1)。
+配信は生きている接続に並行して書き込み、write_timeout 秒以内に書き込めなかった接続や
+書き込みに失敗した接続はその場で切断して取り除く。keepalive_interval 秒ごとに
+コメント行を送り、メッセージが流れていない間も切れた接続を検出する。
+"""
+import asyncio
+import itertools
+import time
+
+KEEPALIVE_FRAME = b': keepalive\n\n'
+
+
+class SSEConnection:
+    __slots__ = ('id', 'request', 'response', 'connected_at', 'closed')
+
+    def __init__(self, conn_id, request, response):
+        self.id = conn_id
+        self.request = request
+        self.response = response
+        self.connected_at = time.time()
+        # 切断したら set され、handle_events の待機が終わる
+        self.closed = asyncio.Event()
+
+
+class SSERegistry:
+    def __init__(self, max_connections=1000, write_timeout=5.0, keepalive_interval=15.0):
+        self.max_connections = max_connections
+        self.write_timeout = write_timeout
+        self.keepalive_interval = keepalive_interval
+        self.connections = {}
+        self._ids = itertools.count(1)
+        self._task = None
+        # 統計
+        self.rejected = 0
+        self.reaped = 0
+
+    def __len__(self):
+        return len(self.connections)
+
+    def add(self, request, response):
+        """接続を登録する。上限に達していれば None を返す"""
+        if len(self.connections) >= self.max_connections:
+            self.rejected += 1
+            return None
+        conn = SSEConnection(next(self._ids), request, response)
+        self.connections[conn.id] = conn
+        return conn
+
+    def remove(self, conn_id):
+        conn = self.connections.pop(conn_id, None)
+        if conn is not None:
+            conn.closed.set()
+        return conn
+
+    async def broadcast(self, data):
+        """全接続に data を書き込み、失敗・タイムアウトした接続を取り除く"""
+        if not self.connections:
+            return
+        conns = list(self.connections.values())
+        results = await asyncio.gather(*(self._write(conn, data) for conn in conns), return_exceptions=True)
+        for conn, result in zip(conns, results):
+            if isinstance(result, BaseException):
+                self._reap(conn, result)
+
+    async def _write(self, conn, data):
+        await asyncio.wait_for(conn.response.write(data), self.write_timeout)
+
+    def _reap(self, conn, error):
+        if self.remove(conn.id) is None:
+            return
+        self.reaped += 1
+        reason = 'write timed out' if isinstance(error, asyncio.TimeoutError) else repr(error)
+        print(f"Dropping SSE client {conn.id} ({conn.request.remote}): {reason}")
+        # 書きかけのデータが残っている接続は待たずに閉じる
+        transport = conn.request.transport
+        if transport is not None:
+            transport.abort()
+
+    async def start(self):
+        self._task = asyncio.create_task(self._keepalive())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for conn_id in list(self.connections):
+            self.remove(conn_id)
+
+    async def _keepalive(self):
+        while True:
+            await asyncio.sleep(self.keepalive_interval)
+            await self.broadcast(KEEPALIVE_FRAME)
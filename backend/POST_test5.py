@@ -3,21 +3,109 @@ import json
 from datetime import datetime
 from aiohttp import web
 from aiohttp_sse import sse_response # SSEレスポンスをインポート
-import weakref # SSEクライアントを管理するために追加
-from collections import defaultdict
-
-# 接続中のSSEクライアントを保持するセット (weakrefを使用してメモリリークを防ぐ)
-sse_clients = weakref.WeakSet()
-
-# 計測対象のアルファベットとその順序を定義
-TARGET_ALPHABETS = ['e', 'v', 'c', 'b', 'm', 'p', 'd', 's', 'a', 'l', 't', 'h', 'k', 'x']
+import argparse
+import logging
+import math
+import multiprocessing
+import queue
+import time
+from array import array
+from collections import defaultdict, deque
+from shared_counters import SharedCounterBlock, SharedCounterReader
+from classifier import TARGET_ALPHABETS, Classifier
+from broadcaster import SSEBroadcaster, OVERFLOW_POLICIES, DROP_OLDEST
+from ingest import IngestQueue, QueueOverflow, SHED_POLICIES, SHED_NEWEST
+from tick_scheduler import TickScheduler, MISSED_TICK_POLICIES, SKIP
+import udp_protocol
+from control_channel import ControlChannel
+from logging_setup import setup_logging, parse_key_values
+import metrics
+from tracing import LatencyTracer
+from loop_monitor import LoopMonitor
+from timeseries import CountHistory
+from journal import EventJournal
+from moderation import Moderator, BLOCKED
+
+# ロガー名をメッセージ種別として、種別ごとにサンプリング・レート制限できる
+logger = logging.getLogger('webhook')
+request_logger = logging.getLogger('webhook.request')
+event_logger = logging.getLogger('webhook.event')
+count_logger = logging.getLogger('aggregator.count')
+udp_logger = logging.getLogger('udp')
+tick_logger = logging.getLogger('udp.tick')
+sse_logger = logging.getLogger('sse')
+
+# 接続中のSSEクライアントへの配信を担うブロードキャスター (起動時の引数で設定を上書き)
+sse_broadcaster = SSEBroadcaster()
+
+# /metrics で公開するメトリクス (ホットパスでは加算のみ、テキスト化はスクレイプ時)
+METRICS = metrics.Registry()
+REQUESTS = METRICS.counter('webhook_requests_total', 'Webhook requests received on /test')
+EVENTS = METRICS.counter('webhook_events_total', 'LINE events received on /test')
+CLASSIFIED = METRICS.counter('classification_total', 'Text messages by classification outcome', ['outcome'])
+REQUEST_LATENCY = METRICS.histogram('handle_post_duration_seconds', 'Time spent in handle_post')
+UDP_PACKETS = METRICS.counter('udp_packets_sent_total', 'Counts packets sent to the UDP receiver')
+UDP_ERRORS = METRICS.counter('udp_send_errors_total', 'Counts packets that failed to send')
+TICK_LATENESS = METRICS.histogram('udp_tick_lateness_seconds', 'How late each UDP tick fired after its deadline')
+LOOP_LAG = METRICS.histogram('event_loop_lag_seconds', 'Extra delay observed by a periodic asyncio.sleep')
+LOOP_STALLS = METRICS.counter('event_loop_stalls_total', 'Times the event loop was blocked past the stall threshold')
+MODERATED = METRICS.counter('sse_messages_moderated_total', 'Messages by server-side moderation result',
+                            ['kind', 'reason'])
+METRICS.function('sse_clients', 'Connected SSE clients', 'gauge', lambda: len(sse_broadcaster))
+METRICS.function('sse_frames_published_total', 'Events published to SSE', 'counter',
+                 lambda: sse_broadcaster.published)
+METRICS.function('sse_frames_sent_total', 'Frames written to SSE clients', 'counter', sse_broadcaster.total_sent)
+METRICS.function('sse_frames_dropped_total', 'Frames dropped because a client queue overflowed', 'counter',
+                 sse_broadcaster.total_dropped)
+METRICS.function('sse_topic_subscribers', 'SSE clients subscribed to each topic', 'gauge',
+                 lambda: {(topic,): sse_broadcaster.subscriber_count(topic) for topic in SSE_TOPICS}, ['topic'])
+METRICS.function('sse_frames_replayed_total', 'Frames resent to reconnecting clients from Last-Event-ID', 'counter',
+                 lambda: sse_broadcaster.replayed)
+METRICS.function('sse_clients_disconnected_total', 'SSE clients that went away', 'counter',
+                 lambda: sse_broadcaster.disconnected)
+
+# LINEのイベント時刻 → 受信 → 分類 → UDP tick / SSE書き込み の区間レイテンシ
+tracer = LatencyTracer(METRICS)
+sse_broadcaster.on_write = tracer.sse_written
+
+# ループの遅延を計測し、閾値を超えて塞がれたときのスタックを /admin/loop に残す
+loop_monitor = LoopMonitor(LOOP_LAG, LOOP_STALLS)
+# True にすると asyncio のデバッグモードで遅いコールバックも警告させる (オーバーヘッドあり)
+asyncio_debug = False
+
+# SSEのトピック。/sse?topics=emoji,counts のように購読するものを選べる
+# (emoji / text / blocked はメッセージの判定結果、counts はtickごとのカウント、scene はシーン切り替え)
+SSE_TOPICS = ('emoji', 'text', 'blocked', 'counts', 'scene')
+# topics を指定しない場合は従来通りメッセージだけを配る
+DEFAULT_SSE_TOPICS = frozenset(('emoji', 'text', 'blocked'))
+
+# SSEで配るメッセージの絵文字判定・モデレーション (各画面で判定し直さなくて済むよう結果を載せる)
+moderator = Moderator()
+# True ならブロック対象のメッセージをSSEで配らない
+drop_blocked = False
+
+# ワーカーモード時、SSE配信用のテキストをオーナープロセスへ中継するキュー (単一プロセス時はNone)
+sse_relay_queue = None
+# オーナーが中継キューから一度に取り出す最大件数
+RELAY_BATCH_SIZE = 500
 
 class DataAggregator:
+    """アルファベットごとの受信回数を集計するダブルバッファ
+
+    add_data はアクティブなバッファへのインデックス加算のみ、
+    tick側は drain() でバッファを入れ替えて前tickの値を受け取る。
+    どちらも await を含まないため、イベントループ上ではロックなしで不可分に実行される。
+    """
     def __init__(self):
-        # アルファベットごとの受信回数を集計
-        self.reset_alphabet_counts()
-        # asyncio用のロック
-        self.lock = asyncio.Lock()
+        # 受信テキスト → バッファ上のインデックス (起動時に一度だけ構築)
+        self.classifier = Classifier(TARGET_ALPHABETS)
+        # アルファベットごとの受信回数を集計 (アクティブ / 予備の2面)
+        self._active = array('i', [0]) * len(TARGET_ALPHABETS)
+        self._spare = array('i', [0]) * len(TARGET_ALPHABETS)
+        self._zeros = array('i', [0]) * len(TARGET_ALPHABETS)
+        # 現在のtickに数えたイベントのトレース (UDP送信側が trace_ticks を立てている間だけ溜める)
+        self.trace_ticks = False
+        self._traces = []
 
         # 設定可能なテキストと値
         self.ait_text = "AITStart2025"
@@ -28,50 +116,109 @@ class DataAggregator:
         self.configurable_value = 2
         self.ait_sent = False
 
-    def reset_alphabet_counts(self):
-        # 各アルファベットのカウントを0に初期化
-        self.alphabet_counts = {letter: 0 for letter in TARGET_ALPHABETS}
-
-    async def add_data(self, text, timestamp):
-        """受信テキストを処理して、対象のアルファベットの出現回数をカウント"""
-        async with self.lock:
-            # テキストが単一文字で、かつ対象のアルファベットの場合のみカウント
-            emoji_mapping = {'😄': 'e', '🥰': 'v', '🤩': 'c', '🥳': 'b', '👍': 'm', '❤️': 'p', '❤️‍️': 'p'}
-            # First, check if the text is a known emoji
-            if text in emoji_mapping:
-                letter = emoji_mapping[text]
-                self.alphabet_counts[letter] += 1
-                print(f"Counted emoji: {text} as alphabet: {letter}, current counts: {self.alphabet_counts}")
-            # Else, check if it's a single target alphabet character
-            elif len(text) == 1 and text.lower() in TARGET_ALPHABETS:
-                text_lower = text.lower()
-                self.alphabet_counts[text_lower] += 1
-                print(f"Counted alphabet: {text_lower}, current counts: {self.alphabet_counts}")
-            # Otherwise, log as unknown
-            else:
-                # Avoid error for multi-character strings in ord()
-                ordinal_info = f"ordinal value: {ord(text[0])}" if len(text) > 0 else "empty string"
-                print(f"Unknown character or non-target input: {text}, {ordinal_info}")
+    @property
+    def alphabet_counts(self):
+        """現在のtickのカウント (ログ表示用)"""
+        return dict(zip(TARGET_ALPHABETS, self._active))
+
+    async def add_data(self, text, timestamp, trace=None):
+        """受信テキストを処理して、対象のアルファベットの出現回数をカウント
+
+        数えた場合は TARGET_ALPHABETS 上のインデックス、対象外なら None を返す。
+        """
+        # 既知の絵文字、または単一の対象アルファベットの場合のみカウント
+        index = self.classifier.classify(text)
+        if trace is not None:
+            tracer.classified(trace)
+        if index is not None:
+            self._increment(index)
+            if trace is not None and self.trace_ticks:
+                self._traces.append(trace)
+            CLASSIFIED.labels('letter' if len(text) == 1 and text.isascii() else 'emoji').inc()
+            count_logger.debug("Counted: %s as alphabet: %s", text, TARGET_ALPHABETS[index])
+        # Otherwise, log as unknown
+        else:
+            CLASSIFIED.labels('unknown').inc()
+            # Avoid error for multi-character strings in ord()
+            ordinal_info = f"ordinal value: {ord(text[0])}" if len(text) > 0 else "empty string"
+            count_logger.debug("Unknown character or non-target input: %s, %s", text, ordinal_info)
+        return index
+
+    def _increment(self, index):
+        self._active[index] += 1
+
+    def drain(self):
+        """バッファを入れ替え、直前までのカウントを TARGET_ALPHABETS の順の配列で返す"""
+        drained = self._active
+        self._active = self._spare
+        snapshot = drained.tolist()
+        # 取り出した面をゼロに戻して次回の予備にする
+        drained[:] = self._zeros
+        self._spare = drained
+        return snapshot
+
+    def take_traces(self):
+        """drain() と同じtickに数えたイベントのトレースを取り出す"""
+        traces, self._traces = self._traces, []
+        return traces
 
     async def get_aggregated_data(self):
-        """アルファベット出現回数を配列形式で取得"""
-        async with self.lock:
-            # 指定された順序でアルファベットカウントを取得（配列形式）
-            counts_array = [self.alphabet_counts[letter] for letter in TARGET_ALPHABETS]
-            return counts_array
+        """アルファベット出現回数を配列形式で取得 (リセットはしない)"""
+        return self._active.tolist()
 
     async def reset(self):
         """カウントデータをリセット"""
-        async with self.lock:
-            self.reset_alphabet_counts()
+        self.drain()
+
+class SharedMemoryAggregator(DataAggregator):
+    """ワーカープロセス用。カウントを共有メモリ上の自分の行に書き込む
+
+    ワーカー側では drain() されないので、ローカルのバッファには積まない
+    (ログ表示用の値は共有メモリ上の自分の行 (64bit) から読む)。
+    """
+    def __init__(self, block, worker_index):
+        super().__init__()
+        self.block = block
+        self.worker_index = worker_index
+
+    @property
+    def alphabet_counts(self):
+        """このワーカーの累計 (ログ表示用)"""
+        return dict(zip(TARGET_ALPHABETS, self.block.row(self.worker_index)))
+
+    def _increment(self, index):
+        self.block.increment(self.worker_index, index)
+
+    async def get_aggregated_data(self):
+        return self.block.row(self.worker_index)
 
 class AsyncUDPSender:
-    def __init__(self, aggregator, host='100.78.136.99', port=5005):
+    def __init__(self, aggregator, host='100.78.136.99', port=5005,
+                 tick_rate=1.0, missed_tick_policy=SKIP, stamp_tick=False, wire_format=udp_protocol.LEGACY,
+                 history_seconds=3600):
         self.aggregator = aggregator
         self.host = host
         self.port = port
         self.transport = None
         self.protocol = None
+        # 送信周期 (Hz) と、処理が遅れてtickを取りこぼしたときの扱い
+        self.tick_rate = tick_rate
+        self.missed_tick_policy = missed_tick_policy
+        # legacy の場合、True ならカウント配列の後ろにtick番号 (int) を付けて送信する
+        self.stamp_tick = stamp_tick
+        # パケット形式 (legacy: 従来のint配列, v1: ヘッダ付き。udp_protocol を参照)
+        if wire_format not in udp_protocol.WIRE_FORMATS:
+            raise ValueError(f"Unknown wire format: {wire_format}")
+        self.wire_format = wire_format
+        self.encoder = udp_protocol.PacketEncoder(TARGET_ALPHABETS, 1.0 / tick_rate)
+        # 直近 history_seconds 秒分のtickごとのカウント (/counts/history で集計して返す)
+        self.history = CountHistory(TARGET_ALPHABETS, max(1, int(history_seconds * tick_rate)), 1.0 / tick_rate)
+
+    def encode(self, counts_array, tick_index):
+        """カウント配列をUDPパケットに変換"""
+        if self.wire_format == udp_protocol.V1:
+            return self.encoder.encode(counts_array, tick_index)
+        return udp_protocol.encode_legacy(counts_array, tick_index if self.stamp_tick else None)
 
     async def start_sending(self):
         loop = asyncio.get_running_loop()
@@ -82,182 +229,389 @@ class AsyncUDPSender:
                 lambda: asyncio.DatagramProtocol(), # UDPプロトコルを使用
                 remote_addr=(self.host, self.port)
             )
-            print(f"UDP Sender connected to {self.host}:{self.port}")
+            udp_logger.info("UDP Sender connected to %s:%s", self.host, self.port)
         except Exception as e:
-            print(f"Failed to create UDP endpoint: {e}")
+            udp_logger.error("Failed to create UDP endpoint: %s", e)
             return # 接続に失敗した場合は停止
 
-        while True:
-            print("[UDP Loop] Starting iteration.")
-            try:
-                # 1秒ごとに集計データを送信
-                counts_array = await self.aggregator.get_aggregated_data()
-                
-                # カウントが0でない場合に送信（全て0の場合も送信する場合はこの条件を削除）
-                if any(counts_array) or False:  # 常に送信する場合
-                    try:
-                        import struct
-                        # 配列をバイナリデータに変換して送信
-                        message = struct.pack('i' * len(counts_array), *counts_array)
-                        self.transport.sendto(message)
-                        print(f"Sent UDP data: {len(message)} bytes to port {self.port}")
-                    except Exception as e:
-                        print(f"UDP送信エラー: {e}")
-                        # 送信に失敗した場合（例：ネットワークの問題）に再接続を試みる
+        # 処理時間に関係なく tick の境界ちょうどに起きる
+        scheduler = TickScheduler(self.tick_rate, self.missed_tick_policy)
+        # 共有メモリのリーダーにはトレースがない (ワーカーモードではUDP区間を計測しない)
+        take_traces = getattr(self.aggregator, 'take_traces', None)
+        if take_traces is not None:
+            self.aggregator.trace_ticks = True
+        try:
+            async for tick in scheduler.ticks():
+                tick_logger.debug("Tick %d (late %.1f ms).", tick.index, tick.lateness * 1000)
+                TICK_LATENESS.observe(tick.lateness)
+                try:
+                    # tickごとに集計データを取り出す (バッファの入れ替えと同時にリセットされる)
+                    counts_array = self.aggregator.drain()
+                    traces = take_traces() if take_traces is not None else ()
+                    # 0のtickも時間軸を保つために記録する
+                    self.history.append(counts_array, time.time())
+
+                    # カウントが0でない場合に送信（全て0の場合も送信する場合はこの条件を削除）
+                    if any(counts_array) or False:  # 常に送信する場合
                         try:
-                            self.transport.close()
-                            self.transport, self.protocol = await loop.create_datagram_endpoint(
-                                lambda: asyncio.DatagramProtocol(),
-                                remote_addr=(self.host, self.port)
-                            )
-                            print("Re-established UDP connection.")
-                        except Exception as recon_e:
-                            print(f"Failed to re-establish UDP connection: {recon_e}")
-                            await asyncio.sleep(5) # 接続を再試行する前に待機
-
-                # 送信後にアグリゲーターをリセット
-                await self.aggregator.reset()
-
-                # 1秒待機
-                await asyncio.sleep(1)
-
-            except asyncio.CancelledError:
-                print("UDP sender task cancelled.")
-                if self.transport:
-                    self.transport.close()
-                break
-            except Exception as e:
-                print(f"Error in UDP sending loop: {e}")
-                await asyncio.sleep(1) # 予期せぬエラーでのタイトなループを回避
-
-async def send_sse_message(text):
+                            # 配列をバイナリデータに変換して送信
+                            message = self.encode(counts_array, tick.index)
+                            self.transport.sendto(message)
+                            UDP_PACKETS.inc()
+                            tracer.ticked(traces, tick.index)
+                            if sse_broadcaster.subscriber_count('counts'):
+                                publish_topic('counts', json.dumps({
+                                    "tick": tick.index,
+                                    "counts": {letter: n for letter, n in zip(TARGET_ALPHABETS, counts_array) if n},
+                                }))
+                            udp_logger.debug("Sent UDP data: %d bytes to port %s", len(message), self.port)
+                        except Exception as e:
+                            UDP_ERRORS.inc()
+                            udp_logger.warning("UDP送信エラー: %s", e)
+                            # 送信に失敗した場合（例：ネットワークの問題）に再接続を試みる
+                            try:
+                                self.transport.close()
+                                self.transport, self.protocol = await loop.create_datagram_endpoint(
+                                    lambda: asyncio.DatagramProtocol(),
+                                    remote_addr=(self.host, self.port)
+                                )
+                                udp_logger.info("Re-established UDP connection.")
+                            except Exception as recon_e:
+                                udp_logger.error("Failed to re-establish UDP connection: %s", recon_e)
+                                await asyncio.sleep(5) # 接続を再試行する前に待機
+
+                except Exception as e:
+                    udp_logger.exception("Error in UDP sending loop: %s", e)
+
+        except asyncio.CancelledError:
+            udp_logger.info("UDP sender task cancelled.")
+            if self.transport:
+                self.transport.close()
+        finally:
+            if take_traces is not None:
+                self.aggregator.trace_ticks = False
+
+def publish_topic(topic, data):
+    """メッセージ以外のトピック (counts / scene) のイベントをSSEで配る"""
+    if sse_relay_queue is not None:
+        try:
+            sse_relay_queue.put_nowait((topic, data))
+        except queue.Full:
+            sse_logger.warning("SSE relay queue is full. Dropping %s event.", topic)
+        return
+    # トピック名をイベント名にして、onmessage だけを使う従来の画面には届かないようにする
+    sse_broadcaster.publish(data, event=topic, topic=topic)
+
+async def send_sse_message(text, trace=None):
     """接続中の全てのSSEクライアントにメッセージを送信する"""
-    message_data = json.dumps({"text": text, "timestamp": datetime.now().isoformat()})
-    clients_to_remove = set()
-    for client in list(sse_clients):
+    if sse_relay_queue is not None:
+        # ワーカーモード: SSEクライアントはオーナープロセスが保持しているので中継する
         try:
-            await client.send(message_data)
-        except ConnectionResetError:
-            print(f"Client connection reset. Removing client: {client}")
-            clients_to_remove.add(client)
-        except Exception as e:
-            print(f"Error sending message to SSE client {client}: {e}")
-            clients_to_remove.add(client)
-
-    for client in clients_to_remove:
-        sse_clients.discard(client)
+            sse_relay_queue.put_nowait(text)
+        except queue.Full:
+            sse_logger.warning("SSE relay queue is full. Dropping message.")
+        return
+    # 絵文字判定はここで1メッセージにつき一度だけ行う (ワーカーモードではオーナー側)
+    moderation = moderator.classify(text)
+    MODERATED.labels(moderation.kind, moderation.reason or '').inc()
+    if moderation.kind == BLOCKED and drop_blocked:
+        return
+    message = {"text": text, "timestamp": datetime.now().isoformat(), "kind": moderation.kind}
+    if moderation.reason:
+        message["reason"] = moderation.reason
+    message_data = json.dumps(message)
+    # 一度だけエンコードして各クライアントのキューに積むだけなので、遅いクライアントを待たない
+    sse_broadcaster.publish(message_data, trace=trace, topic=moderation.kind)
+
+def publish_scene(text, value):
+    publish_topic('scene', json.dumps({"text": text, "value": value, "timestamp": datetime.now().isoformat()}))
+
+async def process_event(app, event, received_at=None):
+    """1件のLINEイベントを処理する (集計・UDP送信・SSE配信)
+
+    received_at はリクエストを受け取った時刻 (time.time())。キューモードでは積んだ時点の時刻。
+    """
+    event_logger.debug("Processing event: type=%s", event.get('type'))
+    if event.get('type') == 'message' and event['message'].get('type') == 'text':
+        text = event['message']['text']
+        # LINE Platformからのタイムスタンプを使用、なければ現在時刻
+        timestamp = event.get('timestamp', int(datetime.now().timestamp() * 1000))
+        trace = tracer.start(event, received_at or time.time())
+
+        aggregator = app['aggregator']
+        control_channel = app['control_channel']
+        journal = app.get('journal')
+        # AITStart2025テキストのチェック
+        if text == aggregator.ait_text and not aggregator.ait_sent:
+            # 常設のUDP送信口に任せて待たない (送信・再送はバックグラウンドで行われる)
+            control_channel.send_control(aggregator.ait_value)
+            aggregator.ait_sent = False # 送信フラグをリセット
+            publish_scene(text, aggregator.ait_value)
+            if journal is not None:
+                # 再生時にシーン切り替えも再現できるよう送った値ごと記録する
+                journal.append(trace.received, None, text, aggregator.ait_value)
+        # 設定可能なテキストのチェック
+        elif text == aggregator.configurable_text:
+            control_channel.send_control(aggregator.configurable_value)
+            publish_scene(text, aggregator.configurable_value)
+            if journal is not None:
+                journal.append(trace.received, None, text, aggregator.configurable_value)
+        else:
+            # データ集計 (単一のアルファベットの場合のみカウント)
+            index = await aggregator.add_data(text, timestamp, trace)
+            if journal is not None:
+                # 分類結果ごと記録しておき、クラッシュ後の確認やショーの再生に使う
+                journal.append(trace.received, index, text)
+
+            # SSEクライアントにメッセージを送信（全てのメッセージを送信）
+            await send_sse_message(text, trace)
+            event_logger.debug("Processed text: %s", text)
+
+def is_valid_event(event):
+    """process_event が扱える形のイベントか (テキストメッセージなら message.text が文字列)"""
+    if not isinstance(event, dict):
+        return False
+    if event.get('type') != 'message':
+        return True
+    message = event.get('message')
+    if not isinstance(message, dict):
+        return False
+    return message.get('type') != 'text' or isinstance(message.get('text'), str)
 
 async def handle_post(request):
-    print("[handle_post] Received request.")
+    REQUESTS.inc()
+    start = time.perf_counter()
+    try:
+        return await process_post(request)
+    finally:
+        REQUEST_LATENCY.observe(time.perf_counter() - start)
+
+async def process_post(request):
+    request_logger.debug("Received request.")
+    received_at = time.time()
     try:
         post_data = await request.read()
-        print(f"[handle_post] Read request body: {len(post_data)} bytes.")
+        request_logger.debug("Read request body: %d bytes.", len(post_data))
         payload = json.loads(post_data.decode('utf-8'))
-        print("[handle_post] Parsed JSON payload.")
-
-        # イベントから必要な情報を抽出
-        for event in payload.get('events', []):
-            print(f"[handle_post] Processing event: type={event.get('type')}")
-            if event.get('type') == 'message' and event['message'].get('type') == 'text':
-                text = event['message']['text']
-                # LINE Platformからのタイムスタンプを使用、なければ現在時刻
-                timestamp = event.get('timestamp', int(datetime.now().timestamp() * 1000))
-                
-                aggregator = request.app['aggregator']
-                # AITStart2025テキストのチェック
-                if text == aggregator.ait_text and not aggregator.ait_sent:
-                    try:
-                        import struct
-                        # 整数値をバイナリデータに変換して送信
-                        message = struct.pack('i', aggregator.ait_value)
-                        loop = asyncio.get_running_loop()
-                        new_transport, new_protocol = await loop.create_datagram_endpoint(
-                            lambda: asyncio.DatagramProtocol(),
-                            remote_addr=(aggregator.ait_host, aggregator.ait_port)
-                        )
-                        new_transport.sendto(message)
-                        print(f"Sent UDP data: {len(message)} bytes to {aggregator.ait_host}:{aggregator.ait_port} for AITStart2025")
-                        new_transport.close()
-                        aggregator.ait_sent = False # 送信フラグをリセット
-                    except Exception as e:
-                        print(f"AIT UDP送信エラー: {e}")
-                # 設定可能なテキストのチェック
-                elif text == aggregator.configurable_text:
-                    try:
-                        import struct
-                        # 整数値をバイナリデータに変換して送信
-                        message = struct.pack('i', aggregator.configurable_value)
-                        loop = asyncio.get_running_loop()
-                        new_transport, new_protocol = await loop.create_datagram_endpoint(
-                            lambda: asyncio.DatagramProtocol(),
-                            remote_addr=(aggregator.ait_host, aggregator.ait_port)
-                        )
-                        new_transport.sendto(message)
-                        print(f"Sent UDP data: {len(message)} bytes to {aggregator.ait_host}:{aggregator.ait_port} for configurable text")
-                        new_transport.close()
-                    except Exception as e:
-                        print(f"Configurable text UDP送信エラー: {e}")
-                else:
-                    # データ集計 (単一のアルファベットの場合のみカウント)
-                    await request.app['aggregator'].add_data(text, timestamp)
-
-                    # SSEクライアントにメッセージを送信（全てのメッセージを送信）
-                    await send_sse_message(text)
-                    print(f"Processed text: {text}")
+        request_logger.debug("Parsed JSON payload.")
+        if not isinstance(payload, dict):
+            request_logger.warning("Invalid JSON payload received (not an object)")
+            return web.Response(status=400, text='{"status": "Invalid payload"}', content_type='application/json')
+
+        events = payload.get('events', [])
+        # キューモードでは積んだ後に失敗しても送信元に伝えられないので、積む前に形を確認する
+        if not isinstance(events, list) or not all(is_valid_event(event) for event in events):
+            request_logger.warning("Invalid events field received")
+            return web.Response(status=400, text='{"status": "Invalid events"}', content_type='application/json')
+        EVENTS.inc(len(events))
+
+        ingest_queue = request.app.get('ingest_queue')
+        if ingest_queue is not None:
+            # キューモード: 積むだけで即座に応答し、処理はキューの処理タスクに任せる
+            ingest_queue.submit([(event, received_at) for event in events])
+        else:
+            # イベントから必要な情報を抽出
+            for event in events:
+                await process_event(request.app, event, received_at)
 
     except json.JSONDecodeError:
-        print("Invalid JSON payload received")
+        request_logger.warning("Invalid JSON payload received")
         return web.Response(status=400, text='{"status": "Invalid JSON"}', content_type='application/json')
+    except QueueOverflow as e:
+        request_logger.warning("Rejected POST request: %s", e)
+        return web.Response(status=503, text='{"status": "Busy"}', content_type='application/json')
     except Exception as e:
-        print(f"Error processing POST request: {e}")
+        request_logger.exception("Error processing POST request: %s", e)
         return web.Response(status=500, text='{"status": "Internal Server Error"}', content_type='application/json')
 
     # レスポンス送信
     return web.json_response({"status": "OK"})
 
+async def handle_metrics(request):
+    """Prometheus形式のメトリクス"""
+    return web.Response(text=METRICS.render(), content_type='text/plain', charset='utf-8',
+                        headers={'X-Prometheus-Format': '0.0.4'})
+
+async def handle_loop_report(request):
+    """イベントループが塞がれたときのスタックと停止時間 (新しい順)"""
+    return web.json_response(loop_monitor.snapshot())
+
+def configure_monitoring(trace_sample=0.0, stall_threshold=0.1, debug=False):
+    """トレースのサンプリング率とイベントループ監視の設定 (ワーカーにも同じ値を渡して呼ぶ)"""
+    global asyncio_debug
+    tracer.sample_rate = trace_sample
+    loop_monitor.threshold = stall_threshold
+    asyncio_debug = debug
+
+def setup_admin_routes(app):
+    """/metrics・/admin/loop・/ingest/stats を追加する (キューモードなら app['ingest_queue'] を参照)"""
+    app.router.add_get('/ingest/stats', handle_ingest_stats) # キュー深さの確認用
+    setup_metrics(app)
+
+def setup_metrics(app):
+    """/metrics と /admin/loop を追加し、イベントループ監視を開始・停止するフックを登録"""
+    app.router.add_get('/metrics', handle_metrics)
+    app.router.add_get('/admin/loop', handle_loop_report)
+
+    async def start_lag_monitor(app):
+        await loop_monitor.start(asyncio_debug)
+
+    async def stop_lag_monitor(app):
+        await loop_monitor.stop()
+
+    app.on_startup.append(start_lag_monitor)
+    app.on_cleanup.append(stop_lag_monitor)
+
+async def handle_count_history(request):
+    """直近 window 秒のレターごとの合計・毎秒レート・ピーク (step 秒ごと) を返す"""
+    try:
+        window = float(request.query.get('window', 60))
+        step = float(request.query['step']) if 'step' in request.query else None
+    except ValueError:
+        return web.Response(status=400, text='{"status": "Invalid window or step"}', content_type='application/json')
+    # inf / nan は比較をすり抜けて tick 数の計算で例外になるので先に弾く
+    if not math.isfinite(window) or window <= 0 or (step is not None and (not math.isfinite(step) or step <= 0)):
+        return web.Response(status=400, text='{"status": "Invalid window or step"}', content_type='application/json')
+    try:
+        result = request.app['count_history'].window(window, step)
+    except (OverflowError, ValueError):
+        return web.Response(status=400, text='{"status": "Invalid window or step"}', content_type='application/json')
+    return web.json_response(result)
+
+def setup_count_history(app, history):
+    """UDP送信側が記録したカウント履歴を /counts/history で公開する"""
+    app['count_history'] = history
+    app.router.add_get('/counts/history', handle_count_history)
+
+async def handle_ingest_stats(request):
+    """キューモードのキュー深さと処理件数を返す"""
+    ingest_queue = request.app.get('ingest_queue')
+    if ingest_queue is None:
+        return web.json_response({"mode": "direct"})
+    return web.json_response({"mode": "queued", **ingest_queue.stats()})
+
 async def sse_handler(request):
-    """SSE接続を処理するハンドラ"""
-    print("[sse_handler] SSE client connected.")
+    """SSE接続を処理するハンドラ (/sse?topics=emoji,text,counts,scene で購読するトピックを選ぶ)"""
+    topics = DEFAULT_SSE_TOPICS
+    if 'topics' in request.query:
+        topics = frozenset(topic for topic in request.query['topics'].split(',') if topic)
+        unknown = topics.difference(SSE_TOPICS)
+        if unknown or not topics:
+            return web.json_response({"status": "Unknown topics", "topics": sorted(unknown)}, status=400)
+    sse_logger.info("SSE client connected.")
+    resp = None
     try:
         # sse_responseコンテキストマネージャを使用してSSE接続を確立
         async with sse_response(request) as resp:
-            # クライアントを管理リストに追加
-            sse_clients.add(resp)
-            print(f"[sse_handler] Client added. Current clients: {len(sse_clients)}")
-            # クライアントが接続している間、待機
-            # aiohttp-sse の sse_response が接続を管理するため、
-            # 明示的なループは不要。接続が切れるまで待機する。
-            # 必要であれば、ここで初期メッセージなどを送信できる。
-            # 例: await resp.send(json.dumps({"type": "welcome", "message": "Connected!"}))
-            await asyncio.Event().wait() # Keep the handler alive until disconnected
+            sse_logger.info("Client added. Current clients: %d", len(sse_broadcaster) + 1)
+            # 再接続なら Last-Event-ID 以降の取りこぼし分を先に送る
+            # (EventSource を作り直した場合はヘッダーを付けられないのでクエリでも受け付ける)
+            last_event_id = request.headers.get('Last-Event-ID') or request.query.get('last_event_id')
+            # 接続が切れるか、キューが溢れて切断されるまでこのクライアントへの書き込みを続ける
+            client = await sse_broadcaster.serve(resp, last_event_id, topics)
+            if client.dropped:
+                sse_logger.info("Client dropped %d frames.", client.dropped)
+        # 書き込み失敗やキュー溢れでサーバー側から閉じた場合も、送信済みのストリームをそのまま返す
+        return resp
 
     except asyncio.CancelledError:
-        print("[sse_handler] SSE handler cancelled.")
-        # キャンセルされた場合もクリーンアップが必要な場合がある
+        # クライアントの登録解除は serve() の finally で済んでいる。キャンセルはaiohttpに伝える
+        sse_logger.info("SSE handler cancelled.")
+        raise
     except Exception as e:
-        print(f"[sse_handler] Error in SSE handler: {e}")
+        sse_logger.exception("Error in SSE handler: %s", e)
+        if resp is None:
+            raise
+        # ストリームを送り始めた後なので 500 は返せない。そのまま閉じる
+        return resp
     finally:
-        # sse_responseコンテキストマネージャが終了時に自動でクリーンアップするはずだが、
-        # 明示的に削除することも可能 (ただし、WeakSetなので参照がなくなれば自動削除される)
-        # sse_clients.discard(resp) # respがスコープ外に出る前に削除する場合
-        print(f"[sse_handler] SSE client disconnected. Current clients: {len(sse_clients)}")
-        # WeakSetは自動的に参照がなくなったオブジェクトを削除するため、明示的な削除は不要な場合が多い
-        # ただし、接続終了時に確実にリストから除外したい場合は discard を使う
-
-async def main(host='0.0.0.0', port=8081):
-    # 共有アグリゲーターインスタンスを作成
-    aggregator = DataAggregator()
+        sse_logger.info("SSE client disconnected. Current clients: %d", len(sse_broadcaster))
 
-    # UDP送信インスタンスを作成
-    udp_sender = AsyncUDPSender(aggregator)
+def create_app(aggregator, ingest_options=None, control_options=None, journal_path=None, admin_routes=True):
+    """/test と /sse を持つaiohttpアプリケーションを作成
 
-    # aiohttpアプリケーションを作成
+    ingest_options を渡すとキューモードになり、/test は積むだけで即座に応答する。
+    journal_path を渡すと分類済みイベントをジャーナルに追記する。
+    admin_routes=False なら /metrics などは追加しない (ワーカーは別のポートで提供する)。
+    """
     app = web.Application()
     app['aggregator'] = aggregator # アプリケーションの状態にアグリゲーターを保存
 
+    if journal_path is not None:
+        journal = EventJournal(journal_path)
+        app['journal'] = journal
+        METRICS.function('journal_records_written_total', 'Records committed to the event journal', 'counter',
+                         lambda: journal.written)
+        METRICS.function('journal_records_dropped_total', 'Records dropped because the journal fell behind',
+                         'counter', lambda: journal.dropped)
+        METRICS.function('journal_pending_bytes', 'Bytes waiting for the next group commit', 'gauge',
+                         lambda: journal.pending_bytes)
+
+        async def open_journal(app):
+            await journal.open()
+
+        async def close_journal(app):
+            await journal.close()
+
+        app.on_startup.append(open_journal)
+        app.on_cleanup.append(close_journal)
+
+    # シーン制御メッセージ用の常設UDP送信口
+    control_channel = ControlChannel(aggregator.ait_host, aggregator.ait_port, **(control_options or {}))
+    app['control_channel'] = control_channel
+    METRICS.function('control_packets_sent_total', 'Scene-control packets sent (including repeats)', 'counter',
+                     lambda: control_channel.sent)
+    METRICS.function('control_send_errors_total', 'Scene-control packets that failed to send', 'counter',
+                     lambda: control_channel.errors)
+
+    async def open_control_channel(app):
+        try:
+            await control_channel.open()
+        except Exception as e:
+            # 送信時に再度接続を試みるので、ここでは起動を止めない
+            logger.warning("Failed to open control channel: %s", e)
+
+    async def close_control_channel(app):
+        control_channel.close()
+
+    app.on_startup.append(open_control_channel)
+    app.on_cleanup.append(close_control_channel)
+
+    if ingest_options is not None:
+        ingest_queue = IngestQueue(lambda item: process_event(app, *item), **ingest_options)
+        app['ingest_queue'] = ingest_queue
+        METRICS.function('ingest_queue_depth', 'Events waiting in the ingest queue', 'gauge',
+                         lambda: ingest_queue.depth)
+        METRICS.function('ingest_events_shed_total', 'Events dropped or rejected by the ingest queue', 'counter',
+                         lambda: ingest_queue.shed)
+
+        async def start_ingest(app):
+            await ingest_queue.start()
+
+        async def stop_ingest(app):
+            await ingest_queue.stop()
+
+        app.on_startup.append(start_ingest)
+        app.on_cleanup.append(stop_ingest)
+
     # ルートを追加
     app.router.add_post('/test', handle_post) # POSTリクエスト用
     app.router.add_get('/sse', sse_handler)   # SSE接続用
+    if admin_routes:
+        setup_admin_routes(app)
+    return app
+
+async def main(host='0.0.0.0', port=8081, ingest_options=None, udp_options=None, control_options=None,
+               journal_path=None):
+    # 共有アグリゲーターインスタンスを作成
+    aggregator = DataAggregator()
+
+    # UDP送信インスタンスを作成
+    udp_sender = AsyncUDPSender(aggregator, **(udp_options or {}))
+
+    # aiohttpアプリケーションを作成
+    app = create_app(aggregator, ingest_options, control_options, journal_path)
+    setup_count_history(app, udp_sender.history)
 
     # Webサーバーを作成して実行
     runner = web.AppRunner(app)
@@ -267,7 +621,7 @@ async def main(host='0.0.0.0', port=8081):
     # UDP送信タスクを開始
     udp_task = asyncio.create_task(udp_sender.start_sending())
 
-    print(f'Starting async server on http://{host}:{port}...')
+    logger.info('Starting async server on http://%s:%s...', host, port)
     await site.start()
 
     # 中断されるまでサーバーを実行し続ける
@@ -275,16 +629,254 @@ async def main(host='0.0.0.0', port=8081):
         # メインタスクを生かし続ける
         await asyncio.Event().wait()
     except (KeyboardInterrupt, asyncio.CancelledError):
-        print("Server shutting down...")
+        logger.info("Server shutting down...")
     finally:
         # クリーンアップ
         udp_task.cancel()
         await udp_task # UDPタスクのキャンセル完了を待つ
         await runner.cleanup()
-        print("Server stopped.")
+        logger.info("Server stopped.")
+
+async def serve_worker(worker_index, block, host, port, ingest_options=None, control_options=None,
+                       journal_path=None, metrics_port=None):
+    """ワーカープロセス: SO_REUSEPORT で同じポートを共有して /test を処理する
+
+    共有ポートの /metrics はスクレイプのたびに別のワーカーに振り分けられてしまうので、
+    /metrics・/admin/loop・/ingest/stats はワーカーごとの metrics_port で提供し、worker ラベルを付ける。
+    """
+    METRICS.const_labels = {'worker': str(worker_index)}
+    aggregator = SharedMemoryAggregator(block, worker_index)
+    app = create_app(aggregator, ingest_options, control_options, journal_path, admin_routes=False)
+
+    admin_app = web.Application()
+    if 'ingest_queue' in app:
+        admin_app['ingest_queue'] = app['ingest_queue']
+    setup_admin_routes(admin_app)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port, reuse_port=True)
+    admin_runner = web.AppRunner(admin_app)
+    await admin_runner.setup()
+    admin_site = web.TCPSite(admin_runner, host, metrics_port)
+    await site.start()
+    await admin_site.start()
+    logger.info('[worker %d] Listening on http://%s:%s, metrics on http://%s:%s/metrics...',
+                worker_index, host, port, host, metrics_port)
+
+    try:
+        await asyncio.Event().wait()
+    except asyncio.CancelledError:
+        pass
+    finally:
+        await admin_runner.cleanup()
+        await runner.cleanup()
+
+def run_worker(worker_index, block, relay_queue, host, port, ingest_options=None, control_options=None,
+               log_options=None, monitor_options=None, journal_path=None, metrics_port=None):
+    """ワーカープロセスのエントリポイント
+
+    spawn で起動されるのでオーナーのモジュール変数は引き継がれない。設定はすべて引数で受け取る。
+    """
+    global sse_relay_queue
+    sse_relay_queue = relay_queue
+    configure_monitoring(**(monitor_options or {}))
+    # 書き込みスレッドは子プロセスに引き継がれないので、プロセスごとに作り直す
+    log_listener = setup_logging(**(log_options or {}))
+    try:
+        asyncio.run(serve_worker(worker_index, block, host, port, ingest_options, control_options, journal_path,
+                                 metrics_port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        log_listener.stop()
+
+async def relay_sse_messages(relay_queue):
+    """ワーカーから中継されたテキスト・トピックのイベントをオーナーのSSEクライアントへ配信
+
+    スレッドで待つのは最初の1件だけで、起きたらキューに溜まっている分をまとめて取り出す。
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            items = [await loop.run_in_executor(None, relay_queue.get, True, 0.5)]
+        except queue.Empty:
+            continue
+        try:
+            while len(items) < RELAY_BATCH_SIZE:
+                items.append(relay_queue.get_nowait())
+        except queue.Empty:
+            pass
+        for item in items:
+            if isinstance(item, tuple):
+                publish_topic(*item)
+            else:
+                await send_sse_message(item)
+
+async def main_workers(num_workers, host='0.0.0.0', port=8081, sse_port=8082, ingest_options=None,
+                       udp_options=None, control_options=None, log_options=None, monitor_options=None,
+                       journal_path=None, worker_metrics_port=9101):
+    """ワーカープールモード
+
+    num_workers 個のプロセスが同じポートで /test を受け、共有メモリのカウンタを増やす。
+    このプロセス (オーナー) は唯一の AsyncUDPSender を持ち、毎tickカウンタを読み取る。
+    SSEクライアントはワーカー間で共有できないため、/sse はオーナーが sse_port で提供する。
+    ワーカー N の /metrics は worker_metrics_port + N で提供する (オーナーの /metrics は sse_port)。
+    ワーカーは spawn で起動する (ログ書き込みなどのスレッドが動いているプロセスを fork しない)。
+    """
+    context = multiprocessing.get_context('spawn')
+    block = SharedCounterBlock(num_workers, len(TARGET_ALPHABETS))
+    relay_queue = context.Queue(maxsize=10000)
+
+    workers = []
+    for worker_index in range(num_workers):
+        worker_journal = f"{journal_path}.{worker_index}" if journal_path else None
+        process = context.Process(
+            target=run_worker,
+            args=(worker_index, block, relay_queue, host, port, ingest_options, control_options, log_options,
+                  monitor_options, worker_journal, worker_metrics_port + worker_index),
+            daemon=True,
+        )
+        process.start()
+        workers.append(process)
+
+    udp_sender = AsyncUDPSender(SharedCounterReader(block), **(udp_options or {}))
+
+    app = web.Application()
+    app.router.add_get('/sse', sse_handler)
+    # カウント履歴も唯一の送信側を持つオーナーが提供する
+    setup_count_history(app, udp_sender.history)
+    # UDP・SSE・tick のメトリクスはオーナー側、リクエスト系は各ワーカーの /metrics に出る
+    setup_metrics(app)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, sse_port)
+
+    udp_task = asyncio.create_task(udp_sender.start_sending())
+    relay_task = asyncio.create_task(relay_sse_messages(relay_queue))
+
+    logger.info('Started %d workers on http://%s:%s, SSE on http://%s:%s...', num_workers, host, port, host, sse_port)
+    await site.start()
+
+    try:
+        await asyncio.Event().wait()
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        logger.info("Server shutting down...")
+    finally:
+        relay_task.cancel()
+        udp_task.cancel()
+        await asyncio.gather(relay_task, udp_task, return_exceptions=True)
+        await runner.cleanup()
+        for process in workers:
+            process.terminate()
+        for process in workers:
+            process.join()
+        logger.info("Server stopped.")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="LINE Webhook receiver / aggregator")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--workers', type=int, default=1,
+                        help="2以上でSO_REUSEPORTのワーカープールモードで起動")
+    parser.add_argument('--sse-port', type=int, default=8082,
+                        help="ワーカープールモード時に /sse を提供するポート")
+    parser.add_argument('--worker-metrics-port', type=int, default=9101,
+                        help="ワーカープールモード時、ワーカー N の /metrics・/admin/loop・/ingest/stats を PORT+N で提供")
+    parser.add_argument('--sse-queue-size', type=int, default=256,
+                        help="SSEクライアントごとの送信キューの上限")
+    parser.add_argument('--sse-overflow', choices=OVERFLOW_POLICIES, default=DROP_OLDEST,
+                        help="送信キューが溢れたときの方針")
+    parser.add_argument('--sse-replay-size', type=int, default=1024,
+                        help="Last-Event-ID での再接続時に送り直せるよう保持する直近のイベント数")
+    parser.add_argument('--drop-blocked', action='store_true',
+                        help="ブロック対象の絵文字メッセージをSSEで配らない (省略時は kind=blocked を付けて配る)")
+    parser.add_argument('--ingest-mode', choices=('direct', 'queued'), default='direct',
+                        help="queued: イベントをキューに積んで即座に200を返し、処理タスクで処理する")
+    parser.add_argument('--ingest-queue-size', type=int, default=10000)
+    parser.add_argument('--ingest-consumers', type=int, default=4)
+    parser.add_argument('--ingest-overflow', choices=SHED_POLICIES, default=SHED_NEWEST,
+                        help="キューが溢れたときの方針")
+    parser.add_argument('--tick-rate', type=float, default=1.0,
+                        help="UDP送信の周期 (Hz)。例: 10, 20, 60")
+    parser.add_argument('--missed-ticks', choices=MISSED_TICK_POLICIES, default=SKIP,
+                        help="処理が遅れてtickを取りこぼしたときの扱い")
+    parser.add_argument('--stamp-tick', action='store_true',
+                        help="legacy形式でカウント配列の後ろにtick番号を付けて送信する")
+    parser.add_argument('--udp-format', choices=udp_protocol.WIRE_FORMATS, default=udp_protocol.LEGACY,
+                        help="カウント送信のパケット形式 (v1: シーケンス番号・時刻付きのヘッダを付ける)")
+    parser.add_argument('--history-seconds', type=float, default=3600,
+                        help="/counts/history で集計できるように保持するtickごとのカウントの秒数")
+    parser.add_argument('--journal', metavar='PATH',
+                        help="分類済みイベントを追記するジャーナル (journal_replay.py で再生できる)")
+    parser.add_argument('--control-format', choices=udp_protocol.WIRE_FORMATS, default=udp_protocol.LEGACY,
+                        help="シーン制御パケットの形式 (v1: 再送の重複除去用にシーケンス番号を付ける)")
+    parser.add_argument('--control-repeats', type=int, default=1,
+                        help="シーン制御パケットを同じシーケンス番号で送る回数")
+    parser.add_argument('--control-repeat-interval', type=float, default=0.05,
+                        help="シーン制御パケットの再送間隔 (秒)")
+    parser.add_argument('--log-level', default='INFO',
+                        help="DEBUG にするとリクエスト・イベントごとのログも出力する")
+    parser.add_argument('--log-json', action='store_true', help="ログを1行1JSONで出力する")
+    parser.add_argument('--log-sample', action='append', metavar='LOGGER=RATE',
+                        help="ロガーごとのサンプリング率 (例: webhook.event=0.1)。複数指定可")
+    parser.add_argument('--log-rate-limit', action='append', metavar='LOGGER=PER_SEC',
+                        help="ロガーごとの毎秒の上限件数 (例: aggregator.count=50)。複数指定可")
+    parser.add_argument('--stall-threshold', type=float, default=0.1,
+                        help="イベントループがこの秒数以上塞がれたらスタックを採取して /admin/loop に残す")
+    parser.add_argument('--asyncio-debug', action='store_true',
+                        help="asyncio のデバッグモードで遅いコールバックも警告する (オーバーヘッドあり)")
+    parser.add_argument('--trace-sample', type=float, default=0.0,
+                        help="区間ごとのレイテンシを 'trace' ロガーに出力するイベントの割合 (例: 0.01)")
+    return parser.parse_args()
 
 if __name__ == '__main__':
+    args = parse_args()
+    log_options = {
+        'level': args.log_level.upper(),
+        'json_format': args.log_json,
+        'sample_rates': parse_key_values(args.log_sample),
+        'rate_limits': parse_key_values(args.log_rate_limit),
+    }
+    log_listener = setup_logging(**log_options)
+    sse_broadcaster.max_queue = args.sse_queue_size
+    sse_broadcaster.overflow_policy = args.sse_overflow
+    sse_broadcaster.replay = deque(maxlen=args.sse_replay_size)
+    monitor_options = {
+        'trace_sample': args.trace_sample,
+        'stall_threshold': args.stall_threshold,
+        'debug': args.asyncio_debug,
+    }
+    configure_monitoring(**monitor_options)
+    drop_blocked = args.drop_blocked
+    ingest_options = None
+    if args.ingest_mode == 'queued':
+        ingest_options = {
+            'maxsize': args.ingest_queue_size,
+            'consumers': args.ingest_consumers,
+            'shed_policy': args.ingest_overflow,
+        }
+    udp_options = {
+        'tick_rate': args.tick_rate,
+        'missed_tick_policy': args.missed_ticks,
+        'stamp_tick': args.stamp_tick,
+        'wire_format': args.udp_format,
+        'history_seconds': args.history_seconds,
+    }
+    control_options = {
+        'wire_format': args.control_format,
+        'repeats': args.control_repeats,
+        'repeat_interval': args.control_repeat_interval,
+    }
     try:
-        asyncio.run(main())
+        if args.workers > 1:
+            asyncio.run(main_workers(args.workers, args.host, args.port, args.sse_port, ingest_options,
+                                     udp_options, control_options, log_options, monitor_options, args.journal,
+                                     args.worker_metrics_port))
+        else:
+            asyncio.run(main(args.host, args.port, ingest_options, udp_options, control_options, args.journal))
     except KeyboardInterrupt:
-        print("Application terminated by user.")
+        logger.info("Application terminated by user.")
+    finally:
+        # キューに残っているログを書き出してから終了する
+        log_listener.stop()
@@ -0,0 +1,53 @@
+"""Classifier のマイクロベンチマーク
+
+絵文字マッピングを数百件まで増やしても、1メッセージあたりの分類コストが
+ほぼ一定であることを確認する。
+
+    python bench_classifier.py
+"""
+import timeit
+
+from classifier import EMOJI_MAPPING, TARGET_ALPHABETS, Classifier
+
+# 実運用に近いメッセージの混在 (既知の絵文字・異体字・アルファベット・対象外のテキスト)
+MESSAGES = ['😄', '❤️', '❤️‍️', 'E', 'x', 'z', 'こんにちは', '🎉🎉', '👍', 'AITStart2025']
+
+SIZES = [len(EMOJI_MAPPING), 50, 100, 200, 400, 800]
+
+
+def build_mapping(size):
+    """既存のマッピングに合成した絵文字を追加して size 件にする"""
+    mapping = dict(EMOJI_MAPPING)
+    codepoint = 0x1F300
+    while len(mapping) < size:
+        emoji = chr(codepoint)
+        if emoji not in mapping:
+            mapping[emoji] = TARGET_ALPHABETS[codepoint % len(TARGET_ALPHABETS)]
+        codepoint += 1
+    return mapping
+
+
+def bench(size, number=20000, repeat=5):
+    classifier = Classifier(TARGET_ALPHABETS, build_mapping(size))
+    classify = classifier.classify
+
+    def run():
+        for text in MESSAGES:
+            classify(text)
+
+    best = min(timeit.repeat(run, number=number, repeat=repeat))
+    return best / (number * len(MESSAGES)) * 1e9
+
+
+def main():
+    print(f"{'mapping size':>12} {'ns/message':>12}")
+    results = []
+    for size in SIZES:
+        ns = bench(size)
+        results.append(ns)
+        print(f"{size:>12} {ns:>12.1f}")
+    print(f"largest/smallest ratio: {results[-1] / results[0]:.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""SSEクライアントへのファンアウト
+
+イベントは publish() で一度だけバイト列にエンコードされ、各クライアントの
+上限付きキューに積まれる。実際の書き込みはクライアントごとのタスクが行うため、
+遅いクライアントがいても publish 側 (Webhook処理) は待たされない。
+on_write を設定すると、トレース付きで publish したフレームが書き込まれるたびに
+on_write(trace, 書き込み時刻) が呼ばれる (レイテンシ計測用)。
+
+各イベントには単調増加する id を付け、直近 replay_size 件をリングに残しておく。
+再接続してきたクライアントが Last-Event-ID を送ってくれば、それ以降の取りこぼし分を
+1回の書き込みにまとめて送ってから通常の配信に合流させる。
+
+各フレームはトピックを1つ持ち、クライアントは購読するトピックを選べる。
+トピックごとの購読者の索引を持っているので、publish のコストは
+そのトピックを購読しているクライアントの数にだけ比例する。
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+
+logger = logging.getLogger('sse')
+
+# キューが溢れたときの方針
+DROP_OLDEST = 'drop_oldest'   # 古いフレームを捨てて新しいものを残す (間引き)
+DROP_NEWEST = 'drop_newest'   # 新しいフレームを捨てる
+DISCONNECT = 'disconnect'     # 追いつけないクライアントを切断する
+OVERFLOW_POLICIES = (DROP_OLDEST, DROP_NEWEST, DISCONNECT)
+
+# 送るものがない間に切断を検知するためのコメント行
+KEEPALIVE_FRAME = b': keepalive\n\n'
+
+
+def encode_event(data, event=None, event_id=None):
+    """SSEフレームをバイト列にエンコード"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event is not None:
+        lines.append(f"event: {event}")
+    for line in data.splitlines() or ['']:
+        lines.append(f"data: {line}")
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+class SSEClient:
+    """1つのSSE接続とその送信キュー"""
+
+    def __init__(self, response, max_queue, overflow_policy, keepalive_interval=15.0, on_write=None):
+        self.response = response
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self.keepalive_interval = keepalive_interval
+        self.on_write = on_write
+        # (フレーム, トレース) の組
+        self.queue = deque()
+        self.sent = 0
+        self.dropped = 0
+        self.closed = False
+        self._wakeup = asyncio.Event()
+
+    def offer(self, frame, trace=None):
+        """フレームをキューに積む。溢れた場合は overflow_policy に従う"""
+        if self.closed:
+            return
+        if len(self.queue) >= self.max_queue:
+            self.dropped += 1
+            if self.overflow_policy == DROP_NEWEST:
+                return
+            if self.overflow_policy == DISCONNECT:
+                self.close()
+                return
+            self.queue.popleft()
+        self.queue.append((frame, trace))
+        self._wakeup.set()
+
+    def preload(self, frames):
+        """接続直後に送るバイト列を上限に関係なく先頭に置く (再接続時の取りこぼし分)"""
+        self.queue.appendleft((frames, None))
+        self._wakeup.set()
+
+    def close(self):
+        self.closed = True
+        self.queue.clear()
+        self._wakeup.set()
+
+    async def run(self):
+        """キューに溜まったフレームをまとめて書き込み続ける。切断されたら戻る"""
+        while not self.closed:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.keepalive_interval)
+            except asyncio.TimeoutError:
+                self.queue.append((KEEPALIVE_FRAME, None))
+            self._wakeup.clear()
+            if not self.queue:
+                continue
+            batch = list(self.queue)
+            self.queue.clear()
+            try:
+                await self.response.write(b''.join(frame for frame, _ in batch))
+                self.sent += len(batch)
+                if self.on_write is not None:
+                    now = time.time()
+                    for _, trace in batch:
+                        if trace is not None:
+                            self.on_write(trace, now)
+            except (ConnectionResetError, ConnectionError):
+                self.close()
+            except Exception as e:
+                logger.warning("Error sending message to SSE client %s: %s", self.response, e)
+                self.close()
+
+
+class SSEBroadcaster:
+    """接続中の全SSEクライアントにフレームを配る"""
+
+    def __init__(self, max_queue=256, overflow_policy=DROP_OLDEST, keepalive_interval=15.0, replay_size=1024):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self.keepalive_interval = keepalive_interval
+        self.on_write = None
+        self.clients = set()
+        # トピック → 購読しているクライアントの集合 (全トピックを受けるクライアントは wildcard に入る)
+        self.subscribers = {}
+        self.wildcard = set()
+        # 再接続時に送り直すための直近のフレーム (id, トピック, フレーム)
+        self.replay = deque(maxlen=replay_size)
+        # 再起動しても id が戻らないよう、起動時刻 (ミリ秒) から数え始める
+        self.last_id = int(time.time() * 1000)
+        self.replayed = 0
+        # 切断済みクライアントの統計 (メトリクス用)
+        self.published = 0
+        self.disconnected = 0
+        self._closed_sent = 0
+        self._closed_dropped = 0
+
+    def __len__(self):
+        return len(self.clients)
+
+    def total_sent(self):
+        """これまでにクライアントへ書き込んだフレーム数 (スクレイプ時に集計)"""
+        return self._closed_sent + sum(client.sent for client in self.clients)
+
+    def total_dropped(self):
+        """キューが溢れて捨てたフレーム数"""
+        return self._closed_dropped + sum(client.dropped for client in self.clients)
+
+    def subscriber_count(self, topic):
+        return len(self.subscribers.get(topic, ())) + len(self.wildcard)
+
+    def publish(self, data, event=None, trace=None, topic=None):
+        """イベントを一度だけエンコードし、topic の購読者のキューに積む (I/Oは待たない)
+
+        topic が None の場合は全クライアントに配る。
+        """
+        self.last_id += 1
+        frame = encode_event(data, event, self.last_id)
+        self.replay.append((self.last_id, topic, frame))
+        self.published += 1
+        if self.on_write is None:
+            trace = None
+        if topic is None:
+            for client in self.clients:
+                client.offer(frame, trace)
+            return frame
+        for client in self.subscribers.get(topic, ()):
+            client.offer(frame, trace)
+        for client in self.wildcard:
+            client.offer(frame, trace)
+        return frame
+
+    def missed_since(self, last_event_id, topics=None):
+        """last_event_id より後のフレーム (topics に含まれるもの) をまとめたバイト列と件数を返す
+
+        id が不正、またはこのプロセスが配ったものより新しい (別のサーバーの id) 場合は何も返さない。
+        リングから溢れた分は取り戻せないので、残っている分だけを返す。
+        """
+        try:
+            last_event_id = int(last_event_id)
+        except (TypeError, ValueError):
+            return b'', 0
+        if last_event_id >= self.last_id:
+            return b'', 0
+        frames = [frame for event_id, topic, frame in self.replay
+                  if event_id > last_event_id and (topic is None or topics is None or topic in topics)]
+        if self.replay and self.replay[0][0] > last_event_id + 1:
+            logger.info("Replay ring no longer holds ids %d-%d.", last_event_id + 1, self.replay[0][0] - 1)
+        return b''.join(frames), len(frames)
+
+    async def serve(self, response, last_event_id=None, topics=None):
+        """接続が切れるか切断されるまで、このクライアントへの書き込みを行う
+
+        topics はこのクライアントが購読するトピックの集合 (None なら全トピック)。
+        """
+        client = SSEClient(response, self.max_queue, self.overflow_policy, self.keepalive_interval, self.on_write)
+        if last_event_id is not None:
+            # 取りこぼし分は1つのまとまりとしてキューの先頭に置き、最初の書き込みで送る
+            missed, count = self.missed_since(last_event_id, topics)
+            if count:
+                client.preload(missed)
+                self.replayed += count
+        self.clients.add(client)
+        if topics is None:
+            self.wildcard.add(client)
+        else:
+            for topic in topics:
+                self.subscribers.setdefault(topic, set()).add(client)
+        try:
+            await client.run()
+        finally:
+            client.close()
+            self.clients.discard(client)
+            self.wildcard.discard(client)
+            for topic in topics or ():
+                self.subscribers[topic].discard(client)
+            self.disconnected += 1
+            self._closed_sent += client.sent
+            self._closed_dropped += client.dropped
+        return client
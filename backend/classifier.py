@@ -0,0 +1,48 @@
+"""受信テキストを集計用カウンタのインデックスへ分類する"""
+import re
+import unicodedata
+
+# 計測対象のアルファベットとその順序 (カウンタの並び。UDPパケットもこの順で送る)
+TARGET_ALPHABETS = ['e', 'v', 'c', 'b', 'm', 'p', 'd', 's', 'a', 'l', 't', 'h', 'k', 'x']
+
+# 絵文字 → カウント先のアルファベット
+EMOJI_MAPPING = {'😄': 'e', '🥰': 'v', '🤩': 'c', '🥳': 'b', '👍': 'm', '❤️': 'p'}
+
+# 異体字セレクタ (VS1〜VS16)
+_VARIATION_SELECTORS = re.compile('[\ufe00-\ufe0f]')
+ZWJ = '\u200d'
+
+
+def normalize(text):
+    """NFC正規化し、異体字セレクタと前後に取り残されたZWJを取り除く
+
+    例: '❤️' / '❤️‍️' / '❤' はすべて '❤' になる。
+    """
+    text = unicodedata.normalize('NFC', text)
+    text = _VARIATION_SELECTORS.sub('', text)
+    return text.strip(ZWJ)
+
+
+class Classifier:
+    """正規化済み文字列 → カウンタのインデックス の表を起動時に一度だけ構築する"""
+
+    def __init__(self, alphabets, emoji_mapping=EMOJI_MAPPING):
+        self.alphabets = list(alphabets)
+        letter_index = {letter: i for i, letter in enumerate(self.alphabets)}
+        table = {}
+        for letter, index in letter_index.items():
+            table[letter] = index
+            table[letter.upper()] = index
+        for emoji, letter in emoji_mapping.items():
+            index = letter_index[letter]
+            # 受信したままの表記でも正規化後の表記でも一回の辞書引きで当たるようにする
+            table[emoji] = index
+            table[normalize(emoji)] = index
+        self.table = table
+
+    def classify(self, text):
+        """カウント対象ならインデックス、対象外なら None を返す"""
+        index = self.table.get(text)
+        if index is None and text:
+            index = self.table.get(normalize(text))
+        return index
@@ -0,0 +1,116 @@
+"""シーン制御メッセージ (AITStart2025 / Scene2 など) を送る常設のUDP送信口"""
+import asyncio
+import logging
+import random
+
+import udp_protocol
+
+logger = logging.getLogger('control')
+
+
+class ControlChannel:
+    """宛先ごとに1つのデータグラムトランスポートを使い回す
+
+    send_control() は待たずに戻る。パケットが落ちてもシーン切り替えを取りこぼさないよう、
+    同じシーケンス番号で repeats 回まで repeat_interval 秒おきに再送する。
+    legacy 形式 (値のみ) ではシーケンス番号を載せられないため、受信側で重複は除けない。
+
+    シーケンス番号はランダムな値から始める。ワーカーごとの送信口や再起動後の送信口が
+    同じ番号を使うと、受信側で別のシーン切り替えが重複として捨てられてしまうため。
+    """
+
+    def __init__(self, host, port, wire_format=udp_protocol.LEGACY, repeats=1, repeat_interval=0.05):
+        if wire_format not in udp_protocol.WIRE_FORMATS:
+            raise ValueError(f"Unknown wire format: {wire_format}")
+        self.default_destination = (host, port)
+        self.wire_format = wire_format
+        self.repeats = max(1, repeats)
+        self.repeat_interval = repeat_interval
+        self.sequence = random.getrandbits(32)
+        self.sent = 0
+        self.errors = 0
+        self._transports = {}
+        self._opening = {}
+        # 実行中のタスクへの参照 (待っている間にGCで消されないように保持する)
+        self._tasks = set()
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _get_transport(self, destination):
+        transport = self._transports.get(destination)
+        if transport is not None and not transport.is_closing():
+            return transport
+        # 同じ宛先への同時オープンは1回にまとめる
+        opening = self._opening.get(destination)
+        if opening is None:
+            opening = self._spawn(self._connect(destination))
+            self._opening[destination] = opening
+        try:
+            return await opening
+        finally:
+            self._opening.pop(destination, None)
+
+    async def _connect(self, destination):
+        loop = asyncio.get_running_loop()
+        transport, _protocol = await loop.create_datagram_endpoint(
+            lambda: asyncio.DatagramProtocol(),
+            remote_addr=destination,
+        )
+        self._transports[destination] = transport
+        logger.info("Control channel connected to %s:%s", *destination)
+        return transport
+
+    async def open(self, host=None, port=None):
+        """宛先のトランスポートを事前に作っておく"""
+        await self._get_transport((host or self.default_destination[0], port or self.default_destination[1]))
+
+    def send_control(self, value, host=None, port=None):
+        """制御値を送る (待たない)。割り当てたシーケンス番号を返す"""
+        destination = (host or self.default_destination[0], port or self.default_destination[1])
+        sequence = self.sequence
+        self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+        if self.wire_format == udp_protocol.V1:
+            message = udp_protocol.encode_control(value, sequence)
+        else:
+            message = udp_protocol.encode_control(value)
+
+        transport = self._transports.get(destination)
+        if transport is not None and not transport.is_closing():
+            self._send(transport, destination, message, self.repeats)
+        else:
+            self._spawn(self._open_and_send(destination, message))
+        return sequence
+
+    async def _open_and_send(self, destination, message):
+        try:
+            transport = await self._get_transport(destination)
+        except Exception as e:
+            self.errors += 1
+            logger.error("Control channel UDP接続エラー (%s:%s): %s", *destination, e)
+            return
+        self._send(transport, destination, message, self.repeats)
+
+    def _send(self, transport, destination, message, remaining):
+        try:
+            transport.sendto(message)
+            self.sent += 1
+            logger.debug("Sent UDP data: %d bytes to %s:%s", len(message), *destination)
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Control channel UDP送信エラー: %s", e)
+            # 壊れたトランスポートは捨て、次回の送信で作り直す
+            transport.close()
+            self._transports.pop(destination, None)
+            return
+        if remaining > 1:
+            asyncio.get_running_loop().call_later(
+                self.repeat_interval, self._send, transport, destination, message, remaining - 1)
+
+    def close(self):
+        for transport in self._transports.values():
+            transport.close()
+        self._transports.clear()
@@ -0,0 +1,98 @@
+"""Webhookの受信応答とイベント処理を切り離すためのインメモリキュー"""
+import asyncio
+import logging
+
+logger = logging.getLogger('ingest')
+
+# キューが溢れたときの方針
+SHED_NEWEST = 'shed_newest'   # 入りきらない新しいイベントを捨てる
+SHED_OLDEST = 'shed_oldest'   # キュー内の古いイベントを捨てて新しいものを入れる
+REJECT = 'reject'             # リクエスト全体を503で拒否し、LINE側の再送に任せる
+SHED_POLICIES = (SHED_NEWEST, SHED_OLDEST, REJECT)
+
+
+class QueueOverflow(Exception):
+    """REJECT方針でイベントを受け入れられなかった"""
+
+
+class IngestQueue:
+    """上限付きの asyncio.Queue と、それを消費する処理タスクのプール"""
+
+    def __init__(self, handler, maxsize=10000, consumers=4, shed_policy=SHED_NEWEST):
+        if shed_policy not in SHED_POLICIES:
+            raise ValueError(f"Unknown shed policy: {shed_policy}")
+        self.handler = handler
+        self.maxsize = maxsize
+        self.num_consumers = consumers
+        self.shed_policy = shed_policy
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self._tasks = []
+        # 統計
+        self.accepted = 0
+        self.shed = 0
+        self.processed = 0
+        self.errors = 0
+
+    @property
+    def depth(self):
+        return self.queue.qsize()
+
+    def submit(self, events):
+        """イベントをキューに積む (待たない)。受け入れた件数を返す"""
+        if self.shed_policy == REJECT and len(events) > self.maxsize - self.queue.qsize():
+            self.shed += len(events)
+            raise QueueOverflow(f"ingest queue is full ({self.queue.qsize()}/{self.maxsize})")
+
+        accepted = 0
+        for event in events:
+            if self.queue.full():
+                if self.shed_policy == SHED_NEWEST:
+                    self.shed += 1
+                    continue
+                # SHED_OLDEST: 一番古いイベントを捨てて空きを作る
+                self.queue.get_nowait()
+                self.queue.task_done()
+                self.shed += 1
+            self.queue.put_nowait(event)
+            accepted += 1
+        self.accepted += accepted
+        return accepted
+
+    async def _consume(self):
+        while True:
+            event = await self.queue.get()
+            try:
+                await self.handler(event)
+                self.processed += 1
+            except Exception as e:
+                self.errors += 1
+                logger.exception("Error processing event: %s", e)
+            finally:
+                self.queue.task_done()
+
+    async def start(self):
+        for _ in range(self.num_consumers):
+            self._tasks.append(asyncio.create_task(self._consume()))
+
+    async def stop(self, drain_timeout=5.0):
+        """残っているイベントをできるだけ処理してから処理タスクを止める"""
+        try:
+            await asyncio.wait_for(self.queue.join(), drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Stopping with %d events left in queue.", self.depth)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def stats(self):
+        return {
+            "depth": self.depth,
+            "maxsize": self.maxsize,
+            "consumers": self.num_consumers,
+            "shed_policy": self.shed_policy,
+            "accepted": self.accepted,
+            "shed": self.shed,
+            "processed": self.processed,
+            "errors": self.errors,
+        }
@@ -0,0 +1,175 @@
+"""分類済みイベントの追記専用バイナリジャーナル
+
+レコードは長さとCRC32を前に付けた可変長のバイナリで、本体は
+受信時刻 (float64)・TARGET_ALPHABETS 上のインデックス (int16、対象外は -1)・UTF-8テキスト。
+シーン切り替えのトリガー (AITStart2025 / Scene2 など) はインデックスを -2 にし、
+テキストの前に送った制御値 (int32) を置く。
+
+    <II  長さ, crc32(本体)
+    <dh  受信時刻, インデックス
+    <i   制御値 (インデックスが -2 の場合のみ)
+    ...  テキスト
+
+append() はイベントループ上でメモリ上のバッファに積むだけで、flush_interval ごとに
+まとめて書き込み・fsync する (グループコミット)。I/O は専用の1スレッドで行うので
+ループは待たされない。クラッシュで途中まで書かれた末尾のレコードは、次に開いたときに
+CRC で検出して切り詰める。
+"""
+import asyncio
+import logging
+import os
+import struct
+import zlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger('journal')
+
+FRAME = struct.Struct('<II')
+BODY = struct.Struct('<dh')
+SCENE_VALUE = struct.Struct('<i')
+
+# インデックス欄の特別な値
+UNCOUNTED = -1
+SCENE = -2
+
+# シーン切り替えのレコードは index が None で scene_value に制御値が入る
+JournalRecord = namedtuple('JournalRecord', ['timestamp', 'index', 'text', 'scene_value'], defaults=(None,))
+
+
+def encode_record(timestamp, index, text, scene_value=None):
+    if scene_value is not None:
+        body = BODY.pack(timestamp, SCENE) + SCENE_VALUE.pack(scene_value)
+    else:
+        body = BODY.pack(timestamp, UNCOUNTED if index is None else index)
+    body += text.encode('utf-8')
+    return FRAME.pack(len(body), zlib.crc32(body)) + body
+
+
+def scan(f):
+    """ファイルの先頭からレコードを読み、(レコード, 次のレコードの位置) を順に返す
+
+    途中までしか書かれていないレコードやCRCの合わないレコードに当たったらそこで止まる。
+    """
+    offset = f.tell()
+    while True:
+        header = f.read(FRAME.size)
+        if len(header) < FRAME.size:
+            return
+        length, crc = FRAME.unpack(header)
+        body = f.read(length)
+        if len(body) < length or length < BODY.size or zlib.crc32(body) != crc:
+            return
+        timestamp, index = BODY.unpack_from(body)
+        text_start = BODY.size
+        scene_value = None
+        if index == SCENE:
+            if length < BODY.size + SCENE_VALUE.size:
+                return
+            (scene_value,) = SCENE_VALUE.unpack_from(body, BODY.size)
+            text_start += SCENE_VALUE.size
+        try:
+            text = body[text_start:].decode('utf-8')
+        except UnicodeDecodeError:
+            return
+        offset += FRAME.size + length
+        yield JournalRecord(timestamp, None if index < 0 else index, text, scene_value), offset
+
+
+def read_journal(path):
+    """ジャーナルの有効なレコードを先頭から順に返す"""
+    with open(path, 'rb') as f:
+        for record, _offset in scan(f):
+            yield record
+
+
+def recover(path):
+    """壊れた末尾を切り詰め、有効なレコード数を返す"""
+    if not os.path.exists(path):
+        return 0
+    records = 0
+    valid_end = 0
+    with open(path, 'r+b') as f:
+        for _record, valid_end in scan(f):
+            records += 1
+        size = f.seek(0, os.SEEK_END)
+        if size != valid_end:
+            logger.warning("Truncating %d bytes of torn records at the end of %s", size - valid_end, path)
+            f.truncate(valid_end)
+            f.flush()
+            os.fsync(f.fileno())
+    return records
+
+
+class EventJournal:
+    def __init__(self, path, flush_interval=0.05, max_pending_bytes=8 * 1024 * 1024):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_pending_bytes = max_pending_bytes
+        self._pending = []
+        self._pending_bytes = 0
+        self._file = None
+        self._task = None
+        # 書き込みの順序を保つため1スレッドだけ使う
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='journal')
+        # 統計
+        self.recovered = 0
+        self.written = 0
+        self.dropped = 0
+        self.commits = 0
+
+    @property
+    def pending_bytes(self):
+        return self._pending_bytes
+
+    def append(self, timestamp, index, text, scene_value=None):
+        """レコードをバッファに積む (待たない)。書き込みが追いつかない間は捨てて数える"""
+        record = encode_record(timestamp, index, text, scene_value)
+        if self._pending_bytes + len(record) > self.max_pending_bytes:
+            self.dropped += 1
+            return
+        self._pending.append(record)
+        self._pending_bytes += len(record)
+
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        self.recovered = await loop.run_in_executor(self._executor, recover, self.path)
+        self._file = await loop.run_in_executor(self._executor, open, self.path, 'ab')
+        self._task = asyncio.create_task(self._run())
+        logger.info("Journal %s opened (%d existing records).", self.path, self.recovered)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.commit()
+            except Exception as e:
+                logger.exception("Error writing journal: %s", e)
+
+    async def commit(self):
+        """溜まったレコードをまとめて書き込み、fsync する"""
+        if not self._pending:
+            return
+        records, self._pending = self._pending, []
+        self._pending_bytes = 0
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._write, b''.join(records))
+        self.written += len(records)
+        self.commits += 1
+
+    def _write(self, data):
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._file is not None:
+            await self.commit()
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self._executor, self._file.close)
+            self._file = None
+        self._executor.shutdown(wait=True)
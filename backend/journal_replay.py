@@ -0,0 +1,147 @@
+"""イベントジャーナルを DataAggregator と SSE に流し直す再生ツール
+
+    # 記録されたときと同じ間隔で再生 (Unityはカウントを 127.0.0.1:5005、シーン切り替えを 3003 で受ける)
+    python journal_replay.py show.journal
+    # 4倍速で再生し、別のホストのUnityに送る
+    python journal_replay.py show.journal --speed 4 --udp-host 192.168.0.10
+    # 再生せずに件数とレターごとの合計だけ表示 (クラッシュ後の確認用)
+    python journal_replay.py show.journal --summary
+
+ワーカーモードのジャーナル (show.journal.0, show.journal.1, ...) は複数指定すると
+受信時刻順にマージして再生する。--speed 0 は待たずに最速で流す。
+シーン切り替えのレコードは記録された値で制御パケットを送り直し、SSEの scene トピックにも配る。
+"""
+import argparse
+import asyncio
+import heapq
+import json
+import logging
+from collections import Counter
+
+from aiohttp import web
+
+import udp_protocol
+from classifier import TARGET_ALPHABETS
+from control_channel import ControlChannel
+from journal import read_journal
+from logging_setup import setup_logging
+from POST_test5 import (AsyncUDPSender, DataAggregator, publish_scene, send_sse_message, setup_count_history,
+                        sse_handler)
+
+logger = logging.getLogger('replay')
+
+
+def merged_records(paths):
+    """複数のジャーナルを受信時刻順にマージする"""
+    return heapq.merge(*(read_journal(path) for path in paths), key=lambda record: record.timestamp)
+
+
+def summarize(paths):
+    records = 0
+    counts = Counter()
+    scenes = Counter()
+    first = last = None
+    for record in merged_records(paths):
+        records += 1
+        first = record.timestamp if first is None else first
+        last = record.timestamp
+        if record.scene_value is not None:
+            scenes[record.text] += 1
+        elif record.index is not None:
+            counts[TARGET_ALPHABETS[record.index]] += 1
+    return {
+        "records": records,
+        "first": first,
+        "last": last,
+        "duration_s": round(last - first, 3) if records else 0.0,
+        "counts": {letter: counts[letter] for letter in TARGET_ALPHABETS},
+        "scenes": dict(scenes),
+    }
+
+
+async def replay(paths, aggregator, speed, control_channel):
+    """記録時の間隔を speed 倍に縮めて add_data と SSE配信 (シーン切り替えは制御パケットの送信) を呼ぶ"""
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    origin = None
+    replayed = 0
+    for record in merged_records(paths):
+        if origin is None:
+            origin = record.timestamp
+        if speed > 0:
+            # 締め切りベースで待ち、処理時間のずれを溜めない
+            delay = start + (record.timestamp - origin) / speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        if record.scene_value is not None:
+            control_channel.send_control(record.scene_value)
+            publish_scene(record.text, record.scene_value)
+        else:
+            await aggregator.add_data(record.text, int(record.timestamp * 1000))
+            await send_sse_message(record.text)
+        replayed += 1
+        if replayed % 1000 == 0:
+            logger.info("Replayed %d records.", replayed)
+    return replayed
+
+
+async def run(args):
+    aggregator = DataAggregator()
+    udp_sender = AsyncUDPSender(aggregator, args.udp_host, args.udp_port, tick_rate=args.tick_rate)
+    control_channel = ControlChannel(args.udp_host, args.control_port, wire_format=args.control_format)
+
+    app = web.Application()
+    app.router.add_get('/sse', sse_handler)
+    setup_count_history(app, udp_sender.history)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, args.host, args.sse_port)
+    await site.start()
+    await control_channel.open()
+    udp_task = asyncio.create_task(udp_sender.start_sending())
+    logger.info("Replaying %s at %sx. SSE on http://%s:%s/sse, UDP to %s:%s",
+                ', '.join(args.journals), args.speed or 'max', args.host, args.sse_port, args.udp_host, args.udp_port)
+    try:
+        # 画面側がつなぎ直す時間を取ってから始める
+        await asyncio.sleep(args.warmup)
+        replayed = await replay(args.journals, aggregator, args.speed, control_channel)
+        logger.info("Replay finished: %d records.", replayed)
+        # 最後のtickが送られるのを待つ
+        await asyncio.sleep(2.0 / args.tick_rate)
+    finally:
+        udp_task.cancel()
+        await asyncio.gather(udp_task, return_exceptions=True)
+        control_channel.close()
+        await runner.cleanup()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay an event journal through the aggregator and SSE")
+    parser.add_argument('journals', nargs='+', help="POST_test5.py --journal で記録したファイル")
+    parser.add_argument('--speed', type=float, default=1.0, help="再生速度の倍率 (0なら待たずに最速)")
+    parser.add_argument('--summary', action='store_true', help="再生せずに件数と合計だけ表示する")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--sse-port', type=int, default=8083)
+    parser.add_argument('--udp-host', default='127.0.0.1', help="カウントを送るUnityのホスト")
+    parser.add_argument('--udp-port', type=int, default=5005)
+    parser.add_argument('--control-port', type=int, default=3003, help="シーン切り替えの制御パケットを送るポート")
+    parser.add_argument('--control-format', choices=udp_protocol.WIRE_FORMATS, default=udp_protocol.LEGACY,
+                        help="シーン制御パケットの形式")
+    parser.add_argument('--tick-rate', type=float, default=1.0)
+    parser.add_argument('--warmup', type=float, default=3.0, help="再生を始める前に待つ秒数")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.summary:
+        # 読むだけ (壊れた末尾は読み飛ばす。切り詰めはサーバーが次に開いたときに行う)
+        print(json.dumps(summarize(args.journals), ensure_ascii=False, indent=2))
+    else:
+        log_listener = setup_logging()
+        try:
+            asyncio.run(run(args))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            log_listener.stop()
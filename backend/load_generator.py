@@ -0,0 +1,240 @@
+"""合成したLINE Webhookを /test に送り込む負荷生成ツール
+
+    # 毎秒200リクエストを30秒間
+    python load_generator.py --rate 200 --duration 30
+    # 同時接続64で10000リクエスト
+    python load_generator.py --concurrency 64 --requests 10000
+
+p50/p99 のレイテンシとエラー率を表示する。--summary-out を指定すると、
+送り込んだ絵文字・アルファベットの期待カウントをJSONで保存する (udp_receiver.py の照合用)。
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from collections import Counter
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+
+from classifier import EMOJI_MAPPING, TARGET_ALPHABETS, Classifier
+
+# 集計対象外の絵文字とテキスト
+OTHER_EMOJIS = ['🎉', '✨', '🌟', '😊', '🎈', '👏', '🙌', '😂', '💖', '🔥']
+FREE_TEXTS = ['こんにちは', '最高！', 'すごい', 'Hello', 'もう一回！', 'アンコール', '楽しい〜', 'nice']
+AIT_TEXT = "AITStart2025"
+CONFIGURABLE_TEXT = "Scene2"
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class PayloadFactory:
+    """実際のLINE Webhookに近い形のペイロードを作る"""
+
+    def __init__(self, max_batch=5, trigger_ratio=0.0, seed=None):
+        self.random = random.Random(seed)
+        self.max_batch = max_batch
+        self.trigger_ratio = trigger_ratio
+        self.classifier = Classifier(TARGET_ALPHABETS)
+        self.user_ids = [f"U{uuid.UUID(int=self.random.getrandbits(128)).hex}" for _ in range(500)]
+        self.texts = Counter()
+
+    def pick_text(self):
+        roll = self.random.random()
+        if roll < self.trigger_ratio:
+            return self.random.choice([AIT_TEXT, CONFIGURABLE_TEXT])
+        roll = self.random.random()
+        if roll < 0.5:
+            return self.random.choice(list(EMOJI_MAPPING))
+        if roll < 0.7:
+            letter = self.random.choice(TARGET_ALPHABETS)
+            return letter.upper() if self.random.random() < 0.3 else letter
+        if roll < 0.85:
+            return self.random.choice(OTHER_EMOJIS)
+        return self.random.choice(FREE_TEXTS)
+
+    def event(self, text):
+        return {
+            "type": "message",
+            "message": {"type": "text", "id": str(self.random.getrandbits(60)), "text": text},
+            "webhookEventId": uuid.UUID(int=self.random.getrandbits(128)).hex.upper(),
+            "deliveryContext": {"isRedelivery": False},
+            "timestamp": int(time.time() * 1000),
+            "source": {"type": "user", "userId": self.random.choice(self.user_ids)},
+            "replyToken": uuid.UUID(int=self.random.getrandbits(128)).hex,
+            "mode": "active",
+        }
+
+    def payload(self):
+        """1リクエスト分 (1〜max_batch件のイベント) のJSONバイト列、イベント数、期待カウントを返す"""
+        events = []
+        counts = Counter()
+        for _ in range(self.random.randint(1, self.max_batch)):
+            text = self.pick_text()
+            self.texts[text] += 1
+            if text not in (AIT_TEXT, CONFIGURABLE_TEXT):
+                index = self.classifier.classify(text)
+                if index is not None:
+                    counts[TARGET_ALPHABETS[index]] += 1
+            events.append(self.event(text))
+        body = {"destination": "U" + "0" * 32, "events": events}
+        return json.dumps(body, ensure_ascii=False).encode('utf-8'), len(events), counts
+
+
+class LoadStats:
+    def __init__(self):
+        self.latencies = []
+        self.statuses = Counter()
+        self.exceptions = Counter()
+        self.events = 0
+        # 200が返ったリクエストに含まれていた分だけの期待カウント
+        self.expected_counts = Counter()
+        self.started = time.perf_counter()
+        self.finished = None
+
+    @property
+    def requests(self):
+        return sum(self.statuses.values()) + sum(self.exceptions.values())
+
+    @property
+    def errors(self):
+        return sum(n for status, n in self.statuses.items() if status != 200) + sum(self.exceptions.values())
+
+    def summary(self):
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        latencies = sorted(self.latencies)
+        return {
+            "requests": self.requests,
+            "events": self.events,
+            "elapsed_s": round(elapsed, 3),
+            "requests_per_s": round(self.requests / elapsed, 1) if elapsed else 0.0,
+            "error_rate": round(self.errors / self.requests, 4) if self.requests else 0.0,
+            "statuses": dict(self.statuses),
+            "exceptions": dict(self.exceptions),
+            "latency_ms": {
+                "p50": round(percentile(latencies, 0.50) * 1000, 2),
+                "p90": round(percentile(latencies, 0.90) * 1000, 2),
+                "p99": round(percentile(latencies, 0.99) * 1000, 2),
+                "max": round((latencies[-1] if latencies else 0.0) * 1000, 2),
+            },
+        }
+
+
+async def send_one(session, url, factory, stats):
+    body, event_count, counts = factory.payload()
+    start = time.perf_counter()
+    try:
+        async with session.post(url, data=body, headers={'Content-Type': 'application/json'}) as response:
+            await response.read()
+            stats.statuses[response.status] += 1
+            if response.status == 200:
+                stats.expected_counts.update(counts)
+    except Exception as e:
+        stats.exceptions[type(e).__name__] += 1
+        return
+    stats.latencies.append(time.perf_counter() - start)
+    stats.events += event_count
+
+
+async def run_rate(session, url, factory, stats, rate, duration, max_in_flight):
+    """開ループ: 応答を待たずに一定レートでリクエストを発行する"""
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(max_in_flight)
+    tasks = set()
+
+    async def guarded():
+        async with semaphore:
+            await send_one(session, url, factory, stats)
+
+    start = loop.time()
+    total = int(rate * duration)
+    for n in range(total):
+        # 締め切りベースで発行して、処理時間によるずれを溜めない
+        delay = start + n / rate - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        task = asyncio.create_task(guarded())
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+
+
+async def run_concurrency(session, url, factory, stats, concurrency, total_requests, duration):
+    """閉ループ: concurrency 本のワーカーが応答を待ってから次を送る"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + duration if duration else None
+    remaining = [total_requests]
+
+    async def worker():
+        while True:
+            if deadline is not None and loop.time() >= deadline:
+                return
+            if total_requests:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            await send_one(session, url, factory, stats)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def run(args):
+    factory = PayloadFactory(args.max_batch, args.trigger_ratio, args.seed)
+    stats = LoadStats()
+    connector = TCPConnector(limit=max(args.concurrency or 0, args.max_in_flight))
+    async with ClientSession(connector=connector, timeout=ClientTimeout(total=args.timeout)) as session:
+        if args.rate:
+            await run_rate(session, args.url, factory, stats, args.rate, args.duration, args.max_in_flight)
+        else:
+            await run_concurrency(session, args.url, factory, stats, args.concurrency, args.requests,
+                                  args.duration if not args.requests else None)
+    stats.finished = time.perf_counter()
+
+    summary = stats.summary()
+    summary["expected_counts"] = {letter: stats.expected_counts[letter] for letter in TARGET_ALPHABETS}
+    summary["triggers"] = {AIT_TEXT: factory.texts[AIT_TEXT], CONFIGURABLE_TEXT: factory.texts[CONFIGURABLE_TEXT]}
+    return summary
+
+
+def print_summary(summary):
+    latency = summary["latency_ms"]
+    print(f"requests: {summary['requests']}  events: {summary['events']}  "
+          f"elapsed: {summary['elapsed_s']} s  rate: {summary['requests_per_s']} req/s")
+    print(f"latency: p50 {latency['p50']} ms  p90 {latency['p90']} ms  "
+          f"p99 {latency['p99']} ms  max {latency['max']} ms")
+    print(f"error rate: {summary['error_rate'] * 100:.2f}%  statuses: {summary['statuses']}  "
+          f"exceptions: {summary['exceptions']}")
+    print(f"expected counts: {summary['expected_counts']}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="LINE Webhook load generator")
+    parser.add_argument('--url', default='http://localhost:8081/test')
+    parser.add_argument('--rate', type=float, help="毎秒のリクエスト数 (指定しない場合は --concurrency で閉ループ)")
+    parser.add_argument('--duration', type=float, default=10.0, help="実行時間 (秒)")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=0, help="閉ループ時の総リクエスト数 (0なら --duration)")
+    parser.add_argument('--max-in-flight', type=int, default=256, help="開ループ時の同時実行数の上限")
+    parser.add_argument('--max-batch', type=int, default=5, help="1リクエストあたりの最大イベント数")
+    parser.add_argument('--trigger-ratio', type=float, default=0.0,
+                        help="AITStart2025 / Scene2 を混ぜる割合 (本番のUnityに向けないこと)")
+    parser.add_argument('--timeout', type=float, default=10.0)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--summary-out', help="結果と期待カウントをJSONで保存するパス")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    summary = asyncio.run(run(args))
+    print_summary(summary)
+    if args.summary_out:
+        with open(args.summary_out, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
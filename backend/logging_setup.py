@@ -0,0 +1,133 @@
+"""ホットパスを止めないためのログ設定
+
+ホットパスでは QueueHandler がレコードをキューに積むだけで、書き込みは
+QueueListener のバックグラウンドスレッドが行う。ロガー名をメッセージ種別とみなし、
+種別ごとのサンプリング率とレート制限はキューに積む前に適用するので、
+捨てたレコードのコストはほぼかからない。
+"""
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+import time
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s [%(name)s] %(message)s'
+
+# LogRecord の標準属性 (JSON出力で extra として扱わないもの)
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JSONFormatter(logging.Formatter):
+    """1レコード1行のJSONで出力する。extra で渡した値もそのまま含める"""
+
+    def format(self, record):
+        entry = {
+            "ts": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ThrottleFilter(logging.Filter):
+    """ロガー名 (とその親) ごとのサンプリングとレート制限
+
+    sample_rates: {'webhook.event': 0.1} なら 10% だけ通す
+    rate_limits:  {'aggregator.count': 50} なら毎秒50件まで (トークンバケット)
+    WARNING 以上は常に通す。
+    """
+
+    def __init__(self, sample_rates=None, rate_limits=None):
+        super().__init__()
+        self.sample_rates = dict(sample_rates or {})
+        self.rate_limits = dict(rate_limits or {})
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._rules = {}
+        self.suppressed = 0
+
+    def _rule_for(self, name):
+        """ロガー名に一番近い設定を探す (結果はキャッシュ)"""
+        rule = self._rules.get(name)
+        if rule is None:
+            sample, limit = 1.0, None
+            candidate = name
+            while candidate:
+                if sample == 1.0 and candidate in self.sample_rates:
+                    sample = self.sample_rates[candidate]
+                if limit is None and candidate in self.rate_limits:
+                    limit = (candidate, self.rate_limits[candidate])
+                candidate = candidate.rpartition('.')[0]
+            rule = self._rules[name] = (sample, limit)
+        return rule
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        sample, limit = self._rule_for(record.name)
+        if sample < 1.0 and random.random() >= sample:
+            self.suppressed += 1
+            return False
+        if limit is not None:
+            key, per_second = limit
+            now = time.monotonic()
+            with self._lock:
+                tokens, last = self._buckets.get(key, (per_second, now))
+                tokens = min(per_second, tokens + (now - last) * per_second)
+                if tokens < 1.0:
+                    self._buckets[key] = (tokens, now)
+                    self.suppressed += 1
+                    return False
+                self._buckets[key] = (tokens - 1.0, now)
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """フォーマットをホットパスで行わず、リスナー側のハンドラに任せる
+
+    メッセージの引数は書き込み時に評価されるため、変更される可能性のある
+    オブジェクトではなく文字列や数値を渡すこと。
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(level='INFO', json_format=False, sample_rates=None, rate_limits=None, stream=None):
+    """ルートロガーに非同期のハンドラを設定し、開始済みの QueueListener を返す"""
+    log_queue = queue.SimpleQueue()
+    handler = DeferredQueueHandler(log_queue)
+    handler.addFilter(ThrottleFilter(sample_rates, rate_limits))
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JSONFormatter() if json_format else logging.Formatter(TEXT_FORMAT))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def parse_key_values(items, value_type=float):
+    """['webhook.event=0.1', ...] を {'webhook.event': 0.1} にする (コマンドライン引数用)"""
+    result = {}
+    for item in items or []:
+        key, sep, value = item.partition('=')
+        if not sep:
+            raise ValueError(f"expected NAME=VALUE, got {item!r}")
+        result[key] = value_type(value)
+    return result
@@ -0,0 +1,105 @@
+"""イベントループの遅延監視と、ループを止めている処理のスタック採取
+
+ループ上のハートビートが interval ごとに時刻を更新し、別スレッドの監視役が
+それを見張る。threshold を超えて更新されない (= 何かがループを塞いでいる) と、
+その時点のループスレッドのスタックを採取して直近 max_reports 件を保持する。
+ループが再開したときに、止まっていた時間を報告に書き足す。
+"""
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+logger = logging.getLogger('loop')
+
+
+class LoopMonitor:
+    def __init__(self, lag_histogram=None, stall_counter=None, threshold=0.1, interval=0.05, max_reports=50):
+        self.lag_histogram = lag_histogram
+        self.stall_counter = stall_counter
+        self.threshold = threshold
+        self.interval = interval
+        self.reports = deque(maxlen=max_reports)
+        self.stalls = 0
+        self._beat = None
+        self._current = None
+        self._loop_thread_id = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._task = None
+
+    async def start(self, asyncio_debug=False):
+        """ハートビートと監視スレッドを開始する (ループ上で呼ぶ)"""
+        loop = asyncio.get_running_loop()
+        if asyncio_debug:
+            # asyncio 自身も threshold を超えたコールバックを 'asyncio' ロガーに警告する
+            loop.set_debug(True)
+            loop.slow_callback_duration = self.threshold
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name='loop-monitor', daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+
+    async def _heartbeat(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._beat = now
+            lag = max(0.0, loop.time() - start - self.interval)
+            if self.lag_histogram is not None:
+                self.lag_histogram.observe(lag)
+            report = self._current
+            if report is not None:
+                # 監視スレッドが採取した停止の長さを確定させる
+                report["duration_ms"] = round((now - report["_since"]) * 1000, 3)
+                del report["_since"]
+                self._current = None
+                logger.warning("Event loop was blocked for %.1f ms", report["duration_ms"])
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            beat = self._beat
+            if self._current is not None or time.monotonic() - beat < self.threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            report = {
+                "detected_at": time.time(),
+                "duration_ms": None,
+                "stack": traceback.format_stack(frame),
+                "_since": beat,
+            }
+            self.stalls += 1
+            if self.stall_counter is not None:
+                self.stall_counter.inc()
+            self.reports.append(report)
+            self._current = report
+
+    def snapshot(self):
+        """/admin/loop 用の報告 (新しい順)"""
+        reports = []
+        # 監視スレッドが追記するので、コピーしてから読む
+        for report in reversed(list(self.reports)):
+            reports.append({key: value for key, value in report.items() if not key.startswith('_')})
+        return {
+            "threshold_ms": self.threshold * 1000,
+            "stalls": self.stalls,
+            "blocked": self._current is not None,
+            "reports": reports,
+        }
@@ -0,0 +1,177 @@
+"""Prometheus のテキスト形式で出力する軽量なメトリクス
+
+ホットパスでは整数の加算と bisect だけを行い、テキストへの変換は
+/metrics がスクレイプされたときにだけ行う。
+"""
+from bisect import bisect_left
+
+# 秒単位のレイテンシ用の既定バケット
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def _with_const_labels(labels, const_labels):
+    """整形済みのラベル文字列の先頭に const_labels を加える"""
+    if not const_labels:
+        return labels
+    extra = ','.join(f'{k}="{_escape(v)}"' for k, v in const_labels.items())
+    return '{' + extra + (',' + labels[1:] if labels else '}')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """単調増加するカウンタ。labelnames を指定すると labels(...) ごとに値を持つ"""
+    type_name = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.value = 0
+        self._children = {}
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = type(self)(self.name, self.documentation)
+        return child
+
+    def samples(self):
+        if self.labelnames:
+            for values, child in self._children.items():
+                yield self.name, _format_labels(self.labelnames, values), child.value
+        else:
+            yield self.name, '', self.value
+
+
+class Gauge(Counter):
+    """任意に上下する値"""
+    type_name = 'gauge'
+
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+
+class Histogram:
+    """上限値ごとのバケットに観測値を数える"""
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self._children = {}
+
+    def observe(self, value):
+        # 値がちょうど上限と同じ場合もそのバケットに入る (le = less than or equal)
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = Histogram(self.name, self.documentation, self.buckets)
+        return child
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def _own_samples(self, labelnames=(), label_values=()):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            labels = _format_labels(labelnames, label_values, ('le', _format_value(float(bound))))
+            yield f'{self.name}_bucket', labels, cumulative
+        labels = _format_labels(labelnames, label_values)
+        yield f'{self.name}_sum', labels, self.sum
+        yield f'{self.name}_count', labels, cumulative
+
+    def samples(self):
+        if self.labelnames:
+            for values, child in self._children.items():
+                yield from child._own_samples(self.labelnames, values)
+        else:
+            yield from self._own_samples()
+
+
+class FunctionMetric:
+    """スクレイプ時に関数を呼んで値を得る。関数は数値か {ラベル値のタプル: 数値} を返す"""
+
+    def __init__(self, name, documentation, type_name, function, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.type_name = type_name
+        self.function = function
+        self.labelnames = tuple(labelnames)
+
+    def samples(self):
+        value = self.function()
+        if isinstance(value, dict):
+            for values, v in value.items():
+                yield self.name, _format_labels(self.labelnames, values), v
+        else:
+            yield self.name, '', value
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        # 全サンプルに付けるラベル (ワーカーモードでの worker など)
+        self.const_labels = {}
+
+    def register(self, metric):
+        # 同じ名前で登録し直した場合は置き換える (アプリを作り直したときなど)
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, buckets=DEFAULT_BUCKETS, labelnames=()):
+        return self.register(Histogram(name, documentation, buckets, labelnames))
+
+    def function(self, name, documentation, type_name, function, labelnames=()):
+        return self.register(FunctionMetric(name, documentation, type_name, function, labelnames))
+
+    def render(self):
+        """Prometheus のテキスト形式 (version 0.0.4) に変換する"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type_name}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{_with_const_labels(labels, self.const_labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
@@ -0,0 +1,219 @@
+"""絵文字だけのメッセージの判定とモデレーション
+
+フロントエンド (project/src/App.tsx) が受信のたびに各ブラウザで行っていた判定
+(書記素への分割・Emoji プロパティによる絵文字判定・絵文字数の上限・ブロックリスト) を
+サーバーで1メッセージにつき一度だけ行う。結果は SSE のフレームに kind として載せる。
+
+書記素の分割は UAX #29 を絵文字向けに簡略化した正規表現で行う
+(国旗の対、キーキャップ、異体字セレクタ・肌色・タグ・ZWJ で結合された並び、結合文字)。
+"""
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+EMOJI = 'emoji'       # 絵文字だけのメッセージ (絵文字ウォールに流す)
+TEXT = 'text'         # 通常のテキスト (メッセージ一覧に出す)
+BLOCKED = 'blocked'   # 表示しない絵文字メッセージ
+KINDS = (EMOJI, TEXT, BLOCKED)
+
+# ブロックの理由
+TOO_MANY = 'too_many'
+BLOCKED_EMOJI = 'blocked_emoji'
+BLOCKED_COMBINATION = 'blocked_combination'
+
+# 1メッセージあたりの絵文字の上限 (App.tsx の MAX_EMOJI_COUNT_PER_MESSAGE)
+MAX_EMOJI_COUNT_PER_MESSAGE = 5
+
+BLOCKED_SINGLE_EMOJIS = (
+    # ネガティブな感情
+    '😠',  # 怒り顔
+    '😡',  # 激怒
+    '🤬',  # 汚い言葉を使う顔
+    '😤',  # ぷんぷん
+    '💔',  # 失恋・壊れたハート
+    '👎',  # サムズダウン
+    '😩',  # うんざり
+    '😫',  # 疲れた顔
+
+    # 病気・怪我
+    '🤢',  # 吐き気
+    '🤮',  # 嘔吐
+    '🤧',  # くしゃみ
+    '🤕',  # 頭に包帯
+    '🤒',  # 体温計（病気）
+    '🥶',  # 凍える顔 (不快感)
+    '🥵',  # 暑い顔 (不快感)
+    '🩸',  # 血
+    '🩹',  # 絆創膏
+
+    # 感情
+    '💢',  # 怒りマーク
+    '🕳\ufe0f',  # 穴 (無関心・無視)
+
+    # 死・不吉
+    '💀',  # ドクロ
+    '☠\ufe0f',  # ドクロと骨
+    '⚰\ufe0f',  # 棺桶
+    '⚱\ufe0f',  # 骨壷
+    '👻',  # おばけ (文脈によるが、死を連想させることがある)
+    '🔪',  # 包丁 (暴力)
+    '💣',  # 爆弾 (破壊)
+    '💥',  # 衝突・爆発
+    '🔫',  # ピストル (暴力)
+    '🪦',  # 墓石
+
+    # 皮肉・軽蔑・無関心
+    '😒',  # 不満顔
+    '🙄',  # 目を回す (呆れ)
+    '🤦\u200d♀\ufe0f',  # フェイスパーム（女性）
+    '🤦\u200d♂\ufe0f',  # フェイスパーム（男性）
+    '🤷\u200d♀\ufe0f',  # 肩をすくめる（女性）(無関心・知らない)
+    '🤷\u200d♂\ufe0f',  # 肩をすくめる（男性）(無関心・知らない)
+    '👀',  # 目 (詮索・じろじろ見る)
+
+    # 下品・不快
+    '💩',  # うんち
+    '🖕',  # 中指
+
+    # その他不適切
+    '❌',  # バツ印
+    '📉',  # 下降グラフ (失敗・悪化)
+    '⛈\ufe0f',  # 雷雨 (不吉・困難)
+    '⛓\ufe0f',  # 鎖 (束縛・不自由)
+    '🤡',  # ピエロ (嘲笑・馬鹿にする)
+    '🚬',  # 煙草 (健康に悪い)
+
+    # 性的・暴力的な内容
+    '🍑',  # 桃 (性的な意味)
+    '🍆',  # 茄子 (性的な意味)
+    '💋',  # キス (性的な意味)
+    '🍌',  # バナナ (性的な意味)
+    '🍒',  # チェリー (性的な意味)
+    '🏩',  # ラブホテル (性的な意味)
+    '🏨',  # ホテル (性的な意味)
+    '💒',  # 結婚式場(誤解の恐れ)
+
+    # 人物
+    '🙍',  # しかめっ面の人
+    '🙍\u200d♂\ufe0f',  # 男性のしかめっ面
+    '🙍\u200d♀\ufe0f',  # 女性のしかめっ面
+    '🙅',  # NO!のポーズ
+    '🙅\u200d♂\ufe0f',  # 男性のNO!のポーズ
+    '🙅\u200d♀\ufe0f',  # 女性のNO!のポーズ
+    '🤦',  # 顔を手で覆う人
+    '🤦\u200d♂\ufe0f',  # 男性の顔を手で覆う
+    '🤦\u200d♀\ufe0f',  # 女性の顔を手で覆う
+    '👯',  # バニー姿の人
+    '👯\u200d♂\ufe0f',  # 男性のバニー姿
+    '👯\u200d♀\ufe0f',  # 女性のバニー姿
+
+    # 動物
+    '🪳',  # ゴキブリ
+
+    # 記号
+    '🔞',  # 成人向けコンテンツ
+    '☢',  # 放射能マーク
+    '☣',  # バイオハザードマーク
+
+    # 国旗 (思想信条に関わる可能性) は REGIONAL_INDICATOR_PAIRS で全ての組み合わせをブロックする
+    '🏳\ufe0f\u200d🌈',  # レインボーフラッグ (LGBTQ+)
+    '🏳\ufe0f\u200d⚧\ufe0f',  # トランスジェンダーフラッグ
+    '🏴\u200d☠\ufe0f',  # 海賊旗 (海賊)
+    '🏳\ufe0f',  # 白旗 (降伏のイメージ)
+    '🏴',  # 黒旗 (無政府主義、海賊など)
+    '🎌',  # 日の丸の旗 (特定の文脈)
+)
+
+# 絵文字の組み合わせとしてブロックするメッセージ (App.tsx の BLOCKED_EMOJI_COMBINATIONS)
+BLOCKED_EMOJI_COMBINATIONS = frozenset([""])
+
+# Regional Indicator Symbols (U+1F1E6〜U+1F1FF) の全ての組み合わせ = 全ての国旗
+REGIONAL_INDICATOR_PAIRS = frozenset(
+    chr(first) + chr(second)
+    for first in range(0x1F1E6, 0x1F200)
+    for second in range(0x1F1E6, 0x1F200)
+)
+
+# Unicode の Emoji プロパティを持つ文字 (emoji-data.txt、JavaScript の正規表現の Emoji プロパティ相当)
+_EMOJI_CHARS = (
+    '#*0-9©®‼⁉™ℹ↔-↙↩↪⌚⌛⌨⏏'
+    '⏩-⏳⏸-⏺Ⓜ▪▫▶◀◻-◾☀-☄☎☑'
+    '☔☕☘☝☠☢☣☦☪☮☯☸-☺♀♂'
+    '♈-♓♟♠♣♥♦♨♻♾♿⚒-⚗⚙⚛⚜'
+    '⚠⚡⚧⚪⚫⚰⚱⚽⚾⛄⛅⛈⛎⛏⛑⛓'
+    '⛔⛩⛪⛰-⛵⛷-⛺⛽✂✅✈-✍✏✒✔'
+    '✖✝✡✨✳✴❄❇❌❎❓-❕❗❣❤'
+    '➕-➗➡➰➿⤴⤵⬅-⬇⬛⬜⭐⭕〰〽'
+    '㊗㊙'
+    '\U0001f004\U0001f0cf\U0001f170\U0001f171\U0001f17e\U0001f17f\U0001f18e\U0001f191-\U0001f19a'
+    '\U0001f1e6-\U0001f1ff\U0001f201\U0001f202\U0001f21a\U0001f22f\U0001f232-\U0001f23a\U0001f250'
+    '\U0001f251\U0001f300-\U0001f321\U0001f324-\U0001f393\U0001f396\U0001f397\U0001f399-\U0001f39b'
+    '\U0001f39e-\U0001f3f0\U0001f3f3-\U0001f3f5\U0001f3f7-\U0001f4fd\U0001f4ff-\U0001f53d'
+    '\U0001f549-\U0001f54e\U0001f550-\U0001f567\U0001f56f\U0001f570\U0001f573-\U0001f57a\U0001f587'
+    '\U0001f58a-\U0001f58d\U0001f590\U0001f595\U0001f596\U0001f5a4\U0001f5a5\U0001f5a8\U0001f5b1'
+    '\U0001f5b2\U0001f5bc\U0001f5c2-\U0001f5c4\U0001f5d1-\U0001f5d3\U0001f5dc-\U0001f5de\U0001f5e1'
+    '\U0001f5e3\U0001f5e8\U0001f5ef\U0001f5f3\U0001f5fa-\U0001f64f\U0001f680-\U0001f6c5'
+    '\U0001f6cb-\U0001f6d2\U0001f6d5-\U0001f6d7\U0001f6dc-\U0001f6e5\U0001f6e9\U0001f6eb\U0001f6ec'
+    '\U0001f6f0\U0001f6f3-\U0001f6fc\U0001f7e0-\U0001f7eb\U0001f7f0\U0001f90c-\U0001f93a'
+    '\U0001f93c-\U0001f945\U0001f947-\U0001f9ff\U0001fa70-\U0001fa7c\U0001fa80-\U0001fa89'
+    '\U0001fa8f-\U0001fac6\U0001face-\U0001fadc\U0001fadf-\U0001fae9\U0001faf0-\U0001faf8'
+)
+
+# 直前の文字にくっつく文字: 結合文字・異体字セレクタ・キーキャップ・肌色・タグ
+_EXTEND = (
+    '\u0300-\u036f\u1ab0-\u1aff\u1dc0-\u1dff\u20d0-\u20ff\ufe00-\ufe0f\ufe20-\ufe2f\u3099\u309a'
+    '\U0001f3fb-\U0001f3ff\U000e0020-\U000e007f'
+)
+
+GRAPHEME = re.compile(
+    '\r\n'
+    '|[\U0001f1e6-\U0001f1ff]{2}'
+    f'|.[{_EXTEND}]*(?:\u200d.[{_EXTEND}]*)*\u200d?',
+    re.DOTALL,
+)
+_EMOJI_RELATED = re.compile(f'[{_EMOJI_CHARS}\ufe00-\ufe0f\u20e3]|^\u200d$|^\\s+$')
+_VARIATION_SELECTORS = re.compile('[\ufe00-\ufe0f]')
+_ONLY_VARIATION_SELECTORS = re.compile('[\ufe00-\ufe0f]+')
+
+
+def split_graphemes(text):
+    return GRAPHEME.findall(text)
+
+
+def _key(grapheme):
+    """異体字セレクタの有無で取りこぼさないよう、除いた形で比較する"""
+    return _VARIATION_SELECTORS.sub('', grapheme)
+
+
+Moderation = namedtuple('Moderation', ['kind', 'reason', 'emoji_count'])
+
+
+class Moderator:
+    """メッセージを EMOJI / TEXT / BLOCKED に分類する
+
+    同じテキスト (リアクションの絵文字など) が何度も届くので、結果はキャッシュする。
+    """
+
+    def __init__(self, blocked_graphemes=BLOCKED_SINGLE_EMOJIS, blocked_combinations=BLOCKED_EMOJI_COMBINATIONS,
+                 max_emoji_count=MAX_EMOJI_COUNT_PER_MESSAGE, block_flags=True, cache_size=4096):
+        blocked = {_key(g) for g in blocked_graphemes}
+        if block_flags:
+            blocked |= REGIONAL_INDICATOR_PAIRS
+        self.blocked_graphemes = frozenset(blocked)
+        self.blocked_combinations = frozenset(blocked_combinations)
+        self.max_emoji_count = max_emoji_count
+        self.classify = lru_cache(maxsize=cache_size)(self._classify)
+
+    def _classify(self, text):
+        graphemes = split_graphemes(text)
+        if not graphemes or not all(_EMOJI_RELATED.search(g) for g in graphemes):
+            return Moderation(TEXT, None, 0)
+        # 空白と、異体字セレクタだけの書記素は数えない
+        count = sum(1 for g in graphemes if not g.isspace() and not _ONLY_VARIATION_SELECTORS.fullmatch(g))
+        if count > self.max_emoji_count:
+            return Moderation(BLOCKED, TOO_MANY, count)
+        if any(_key(g) in self.blocked_graphemes for g in graphemes):
+            return Moderation(BLOCKED, BLOCKED_EMOJI, count)
+        if text.strip() in self.blocked_combinations:
+            return Moderation(BLOCKED, BLOCKED_COMBINATION, count)
+        return Moderation(EMOJI, None, count)
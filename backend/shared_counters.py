@@ -0,0 +1,62 @@
+"""ワーカープロセス間で共有するカウンタブロック"""
+from multiprocessing import RawArray
+
+
+class SharedCounterBlock:
+    """共有メモリ上のカウンタブロック (行 = ワーカー, 列 = TARGET_ALPHABETS の順)
+
+    各ワーカーは自分の行だけを単調増加させるため、書き込み側にロックは不要。
+    集計側は行を合計し、前回の合計との差分を取ることで「読み取り＋リセット」を行う。
+    """
+
+    def __init__(self, num_workers, width):
+        self.num_workers = num_workers
+        self.width = width
+        # 64bit整数でショー全体の累計を保持 (ワーカー × 列)
+        self.buffer = RawArray('q', num_workers * width)
+
+    def increment(self, worker_index, column):
+        """指定ワーカーの行の指定列を1増やす"""
+        self.buffer[worker_index * self.width + column] += 1
+
+    def row(self, worker_index):
+        """指定ワーカーの累計を列の順に返す"""
+        offset = worker_index * self.width
+        return self.buffer[offset:offset + self.width]
+
+    def totals(self):
+        """全ワーカーの累計を列ごとに合計して返す"""
+        width = self.width
+        buffer = self.buffer
+        totals = [0] * width
+        for row in range(self.num_workers):
+            offset = row * width
+            for column in range(width):
+                totals[column] += buffer[offset + column]
+        return totals
+
+
+class SharedCounterReader:
+    """SharedCounterBlock を DataAggregator と同じインターフェースで読むオーナー側のビュー"""
+
+    def __init__(self, block):
+        self.block = block
+        self._baseline = [0] * block.width
+        self._last_totals = self._baseline
+
+    def drain(self):
+        """前回の drain 以降の増分を配列形式で返し、基準を更新する"""
+        totals = self.block.totals()
+        delta = [now - base for now, base in zip(totals, self._baseline)]
+        self._baseline = totals
+        self._last_totals = totals
+        return delta
+
+    async def get_aggregated_data(self):
+        """前回リセット以降の増分を配列形式で取得"""
+        self._last_totals = self.block.totals()
+        return [now - base for now, base in zip(self._last_totals, self._baseline)]
+
+    async def reset(self):
+        """直前に読み取った時点を基準にする (読み取り後の増分は次のtickに繰り越される)"""
+        self._baseline = self._last_totals
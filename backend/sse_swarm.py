@@ -0,0 +1,194 @@
+"""/sse に大量のクライアントを接続してファンアウトを計測するベンチマーク
+
+    python sse_swarm.py --clients 2000 --slow-ratio 0.1 --disconnect-ratio 0.05 --rate 20 --duration 30
+
+通常のクライアントに加えて、わざと読み出しの遅いクライアントと途中で突然切断する
+クライアントを混ぜる。計測中は一意なマーカーテキストを /test に送り込み、
+各クライアントでの配信レイテンシと取りこぼしたイベント数を数える。
+--server-pid を指定すると /proc からサーバーのメモリ使用量 (RSS) も記録する。
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+
+from load_generator import PayloadFactory, percentile
+
+MARKER_PREFIX = "swarm-"
+
+
+class SwarmClient:
+    def __init__(self, index, kind, read_delay=0.0, lifetime=None):
+        self.index = index
+        self.kind = kind                # 'normal' / 'slow' / 'disconnect'
+        self.read_delay = read_delay
+        self.lifetime = lifetime
+        self.connected_at = None
+        self.disconnected_at = None
+        self.received = {}              # マーカー番号 → 受信時刻
+        self.error = None
+
+
+class Swarm:
+    def __init__(self):
+        self.clients = []
+        self.injected = {}              # マーカー番号 → 送信時刻
+        self.rss_samples = []
+
+    async def run_client(self, session, url, client):
+        try:
+            async with session.get(url, headers={'Accept': 'text/event-stream'}) as response:
+                if response.status != 200:
+                    client.error = f"status {response.status}"
+                    return
+                client.connected_at = time.perf_counter()
+                deadline = client.connected_at + client.lifetime if client.lifetime else None
+                async for line in response.content:
+                    now = time.perf_counter()
+                    if line.startswith(b'data:'):
+                        self.on_data(client, line[5:].strip(), now)
+                    if deadline is not None and now >= deadline:
+                        # 突然切断するクライアント: レスポンスを読みかけのまま閉じる
+                        response.close()
+                        break
+                    if client.read_delay:
+                        await asyncio.sleep(client.read_delay)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            client.error = type(e).__name__
+        finally:
+            client.disconnected_at = time.perf_counter()
+
+    def on_data(self, client, data, now):
+        try:
+            text = json.loads(data).get('text', '')
+        except ValueError:
+            return
+        if isinstance(text, str) and text.startswith(MARKER_PREFIX):
+            client.received.setdefault(int(text[len(MARKER_PREFIX):]), now)
+
+    async def inject(self, session, url, rate, duration):
+        """一意なマーカーテキストを一定レートで /test に送る"""
+        factory = PayloadFactory()
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        for n in range(int(rate * duration)):
+            delay = start + n / rate - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            body = json.dumps({"events": [factory.event(f"{MARKER_PREFIX}{n}")]}).encode('utf-8')
+            self.injected[n] = time.perf_counter()
+            try:
+                async with session.post(url, data=body, headers={'Content-Type': 'application/json'}) as response:
+                    await response.read()
+            except Exception as e:
+                print(f"inject failed: {e}")
+
+    async def sample_rss(self, pid, interval):
+        while True:
+            try:
+                with open(f'/proc/{pid}/status') as f:
+                    for line in f:
+                        if line.startswith('VmRSS:'):
+                            self.rss_samples.append(int(line.split()[1]))
+            except OSError:
+                return
+            await asyncio.sleep(interval)
+
+    def report(self, grace):
+        by_kind = {}
+        for kind in ('normal', 'slow', 'disconnect'):
+            clients = [c for c in self.clients if c.kind == kind]
+            latencies = []
+            missed = []
+            for client in clients:
+                if client.connected_at is None:
+                    continue
+                end = (client.disconnected_at or time.perf_counter()) - grace
+                # 接続していた間に送られたマーカーのうち、届かなかったもの
+                expected = [n for n, sent in self.injected.items() if client.connected_at <= sent <= end]
+                missed.append(sum(1 for n in expected if n not in client.received))
+                latencies.extend(client.received[n] - self.injected[n]
+                                 for n in client.received if n in self.injected)
+            latencies.sort()
+            missed.sort()
+            by_kind[kind] = {
+                "clients": len(clients),
+                "connected": sum(1 for c in clients if c.connected_at is not None),
+                "errors": dict(Counter(c.error for c in clients if c.error)),
+                "latency_ms": {
+                    "p50": round(percentile(latencies, 0.50) * 1000, 2),
+                    "p99": round(percentile(latencies, 0.99) * 1000, 2),
+                    "max": round((latencies[-1] if latencies else 0.0) * 1000, 2),
+                },
+                "missed_events": {
+                    "total": sum(missed),
+                    "p50": percentile(missed, 0.50),
+                    "p99": percentile(missed, 0.99),
+                },
+            }
+        result = {"injected": len(self.injected), "by_kind": by_kind}
+        if self.rss_samples:
+            result["server_rss_kb"] = {"min": min(self.rss_samples), "max": max(self.rss_samples)}
+        return result
+
+
+async def run(args):
+    swarm = Swarm()
+    rng = random.Random(args.seed)
+    for index in range(args.clients):
+        roll = rng.random()
+        if roll < args.slow_ratio:
+            client = SwarmClient(index, 'slow', read_delay=args.slow_delay)
+        elif roll < args.slow_ratio + args.disconnect_ratio:
+            client = SwarmClient(index, 'disconnect', lifetime=rng.uniform(1.0, args.duration))
+        else:
+            client = SwarmClient(index, 'normal')
+        swarm.clients.append(client)
+
+    connector = TCPConnector(limit=0)
+    timeout = ClientTimeout(total=None, sock_connect=30)
+    async with ClientSession(connector=connector, timeout=timeout) as session:
+        tasks = []
+        rss_task = asyncio.create_task(swarm.sample_rss(args.server_pid, 1.0)) if args.server_pid else None
+        for client in swarm.clients:
+            tasks.append(asyncio.create_task(swarm.run_client(session, args.sse_url, client)))
+            if args.connect_rate:
+                await asyncio.sleep(1.0 / args.connect_rate)
+        # 全員の接続を少し待ってからマーカーを送り始める
+        await asyncio.sleep(args.warmup)
+        await swarm.inject(session, args.post_url, args.rate, args.duration)
+        await asyncio.sleep(args.grace)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if rss_task:
+            rss_task.cancel()
+    return swarm.report(args.grace)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="SSE client swarm for fan-out benchmarking")
+    parser.add_argument('--sse-url', default='http://localhost:8081/sse')
+    parser.add_argument('--post-url', default='http://localhost:8081/test')
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--connect-rate', type=float, default=500.0, help="毎秒の新規接続数 (0なら一斉に接続)")
+    parser.add_argument('--slow-ratio', type=float, default=0.05, help="読み出しの遅いクライアントの割合")
+    parser.add_argument('--slow-delay', type=float, default=0.5, help="遅いクライアントが1行ごとに待つ秒数")
+    parser.add_argument('--disconnect-ratio', type=float, default=0.05, help="途中で突然切断するクライアントの割合")
+    parser.add_argument('--rate', type=float, default=10.0, help="毎秒送り込むマーカーの数")
+    parser.add_argument('--duration', type=float, default=20.0)
+    parser.add_argument('--warmup', type=float, default=2.0)
+    parser.add_argument('--grace', type=float, default=2.0, help="送信終了後に配信を待つ秒数")
+    parser.add_argument('--server-pid', type=int, help="RSSを記録するサーバープロセスのPID")
+    parser.add_argument('--seed', type=int)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    print(json.dumps(asyncio.run(run(parse_args())), ensure_ascii=False, indent=2))
@@ -0,0 +1,48 @@
+"""loop.time() の締め切りに合わせて一定周期でtickを発生させるスケジューラ"""
+import asyncio
+from collections import namedtuple
+
+# 遅れて取りこぼしたtickの扱い
+SKIP = 'skip'          # 次の境界まで飛ばす (取りこぼしたtickは発生させない)
+CATCH_UP = 'catch_up'  # 取りこぼしたtickを間を空けずに順番に発生させる
+MISSED_TICK_POLICIES = (SKIP, CATCH_UP)
+
+# index: 開始からのtick番号, deadline: 本来の時刻 (loop.time()), lateness: 実際の遅れ (秒)
+Tick = namedtuple('Tick', ['index', 'deadline', 'lateness'])
+
+
+class TickScheduler:
+    """tick n の締め切りを start + n * period で決めるため、処理時間が積み重なってもずれない"""
+
+    def __init__(self, rate_hz=1.0, missed_tick_policy=SKIP):
+        if rate_hz <= 0:
+            raise ValueError("rate_hz must be positive")
+        if missed_tick_policy not in MISSED_TICK_POLICIES:
+            raise ValueError(f"Unknown missed tick policy: {missed_tick_policy}")
+        self.rate_hz = rate_hz
+        self.period = 1.0 / rate_hz
+        self.missed_tick_policy = missed_tick_policy
+        self.skipped = 0
+
+    async def ticks(self):
+        """tickを無限に発生させる非同期ジェネレータ"""
+        loop = asyncio.get_running_loop()
+        period = self.period
+        start = loop.time()
+        index = 1
+        while True:
+            deadline = start + index * period
+            now = loop.time()
+            if now < deadline:
+                await asyncio.sleep(deadline - now)
+                now = loop.time()
+
+            missed = int((now - deadline) // period)
+            if missed > 0 and self.missed_tick_policy == SKIP:
+                # 最後に過ぎた境界のtickだけを発生させる
+                self.skipped += missed
+                index += missed
+                deadline = start + index * period
+
+            yield Tick(index, deadline, now - deadline)
+            index += 1
@@ -0,0 +1,88 @@
+"""tickごとのカウントを一定期間だけ保持するリングバッファ
+
+UDP送信側が毎tick drain() したカウント配列をそのまま1行として追記する (O(1)、固定メモリ)。
+行は array('i') 上に連続して並べてあるので、レターごとの列は step 付きスライスで
+C の速度のまま取り出せる。窓内の合計・毎秒レート・ピークを返す。
+"""
+import math
+from array import array
+
+
+class CountHistory:
+    def __init__(self, alphabets, capacity, tick_duration):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.alphabets = list(alphabets)
+        self.width = len(self.alphabets)
+        self.capacity = capacity
+        self.tick_duration = tick_duration
+        self._counts = array('i', [0]) * (self.width * capacity)
+        self._times = array('d', [0.0]) * capacity
+        self._next = 0
+        self.size = 0
+
+    def append(self, counts, timestamp):
+        """1tick分のカウント (alphabets の順) を追記する。古い行は上書きされる"""
+        row = self._next * self.width
+        self._counts[row:row + self.width] = array('i', counts)
+        self._times[self._next] = timestamp
+        self._next = (self._next + 1) % self.capacity
+        if self.size < self.capacity:
+            self.size += 1
+
+    def _recent(self, values, stride, offset, n):
+        """直近 n 行分の値を古い順に取り出す"""
+        start = (self._next - n) % self.capacity
+        if start + n <= self.capacity:
+            return values[start * stride + offset:(start + n) * stride:stride]
+        # 末尾で折り返している場合は2つに分けて取り出す
+        return values[start * stride + offset::stride] + values[offset:self._next * stride:stride]
+
+    def window(self, seconds, step=None):
+        """直近 seconds 秒の合計・毎秒レート・ピークを返す
+
+        ピークは step 秒 (既定は1tick) ごとにまとめた合計の最大値。
+        seconds と step は保持している期間に切り詰める (巨大な値で tick 数の計算が溢れないように)。
+        """
+        span = self.capacity * self.tick_duration
+        seconds = min(seconds, span)
+        step = min(step, span) if step else None
+        n = min(self.size, max(1, math.ceil(seconds / self.tick_duration))) if self.size else 0
+        k = max(1, round((step or self.tick_duration) / self.tick_duration))
+        covered = n * self.tick_duration
+        result = {
+            "window_s": covered,
+            "ticks": n,
+            "total": 0,
+            "sums": {},
+            "rates_per_s": {},
+            "peak": {"step_s": k * self.tick_duration, "total": 0, "at": None, "by_letter": {}},
+        }
+        if n == 0:
+            return result
+
+        times = self._recent(self._times, 1, 0, n)
+        columns = [self._recent(self._counts, self.width, col, n) for col in range(self.width)]
+        # step ごとのまとまりの開始時刻
+        bucket_times = times[::k]
+
+        def grouped(values):
+            return values if k == 1 else [sum(values[i:i + k]) for i in range(0, n, k)]
+
+        for letter, column in zip(self.alphabets, columns):
+            total = sum(column)
+            result["sums"][letter] = total
+            result["rates_per_s"][letter] = total / covered
+            buckets = grouped(column)
+            peak = max(buckets)
+            result["peak"]["by_letter"][letter] = {
+                "count": peak,
+                "at": bucket_times[buckets.index(peak)] if peak else None,
+            }
+
+        totals = grouped(list(map(sum, zip(*columns))))
+        peak = max(totals)
+        result["total"] = sum(result["sums"].values())
+        result["peak"]["total"] = peak
+        result["peak"]["at"] = bucket_times[totals.index(peak)] if peak else None
+        return result
@@ -0,0 +1,92 @@
+"""LINEのイベント時刻から UDP tick / SSE書き込みまでのレイテンシ計測
+
+各イベントに小さな Trace を付けて段階ごとの時刻 (time.time()) を記録し、
+区間ごとのヒストグラムに入れる。sample_rate の割合のトレースは、UDP tick に
+含まれた時点で 'trace' ロガーに1件ずつ出力する。
+"""
+import logging
+import random
+import time
+
+trace_logger = logging.getLogger('trace')
+
+# LINE側の遅延やリトライも含めるため、秒〜数十秒まで見られるバケット
+TRACE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0)
+
+
+class Trace:
+    __slots__ = ('event_id', 'line_ts', 'received', 'classified', 'tick_index', 'ticked', 'sse_written', 'sampled')
+
+    def __init__(self, event_id, line_ts, received, sampled):
+        self.event_id = event_id
+        self.line_ts = line_ts
+        self.received = received
+        self.classified = None
+        self.tick_index = None
+        self.ticked = None
+        self.sse_written = None
+        self.sampled = sampled
+
+    def as_dict(self):
+        def ms(later, earlier):
+            return None if later is None or earlier is None else round((later - earlier) * 1000, 3)
+        return {
+            "event_id": self.event_id,
+            "tick_index": self.tick_index,
+            "line_to_received_ms": ms(self.received, self.line_ts),
+            "received_to_classified_ms": ms(self.classified, self.received),
+            "received_to_udp_tick_ms": ms(self.ticked, self.received),
+            "received_to_sse_write_ms": ms(self.sse_written, self.received),
+            "line_to_udp_tick_ms": ms(self.ticked, self.line_ts),
+        }
+
+
+class LatencyTracer:
+    def __init__(self, registry, sample_rate=0.0):
+        self.sample_rate = sample_rate
+        self.line_to_received = registry.histogram(
+            'trace_line_to_received_seconds', 'LINE event timestamp to request received', TRACE_BUCKETS)
+        self.received_to_classified = registry.histogram(
+            'trace_received_to_classified_seconds', 'Request received to message classified', TRACE_BUCKETS)
+        self.received_to_tick = registry.histogram(
+            'trace_received_to_udp_tick_seconds', 'Request received to inclusion in a UDP tick', TRACE_BUCKETS)
+        self.line_to_tick = registry.histogram(
+            'trace_line_to_udp_tick_seconds', 'LINE event timestamp to inclusion in a UDP tick', TRACE_BUCKETS)
+        self.received_to_sse = registry.histogram(
+            'trace_received_to_sse_write_seconds', 'Request received to SSE frame written (per client)',
+            TRACE_BUCKETS)
+
+    def start(self, event, received):
+        """イベントの受信時刻からトレースを開始する"""
+        line_ts = event.get('timestamp')
+        line_ts = line_ts / 1000 if isinstance(line_ts, (int, float)) else None
+        event_id = event.get('webhookEventId') or event.get('message', {}).get('id')
+        trace = Trace(event_id, line_ts, received, self.sample_rate > 0 and random.random() < self.sample_rate)
+        if line_ts is not None:
+            self.line_to_received.observe(max(0.0, received - line_ts))
+        return trace
+
+    def classified(self, trace):
+        trace.classified = time.time()
+        self.received_to_classified.observe(trace.classified - trace.received)
+
+    def ticked(self, traces, tick_index):
+        """tick_index のUDPパケットに含まれたトレースを記録する"""
+        now = time.time()
+        for trace in traces:
+            trace.tick_index = tick_index
+            trace.ticked = now
+            self.received_to_tick.observe(now - trace.received)
+            if trace.line_ts is not None:
+                self.line_to_tick.observe(max(0.0, now - trace.line_ts))
+            if trace.sampled:
+                fields = trace.as_dict()
+                # テキスト形式ではメッセージに、JSON形式では各フィールドとして出る
+                trace_logger.info("trace %s", fields, extra=fields)
+
+    def sse_written(self, trace, now=None):
+        """SSEクライアントへの書き込みごとに呼ばれる"""
+        now = now or time.time()
+        if trace.sse_written is None:
+            trace.sse_written = now
+        self.received_to_sse.observe(now - trace.received)
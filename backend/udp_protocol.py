@@ -0,0 +1,192 @@
+"""カウント送信用UDPパケットのエンコーダ / デコーダ
+
+legacy: int32 の配列をそのまま並べた従来形式 (ヘッダなし、ネイティブエンディアン)
+v1:     以下のリトルエンディアンのヘッダ + int32 (LE) × count
+
+    offset size  field
+    0      2     magic            b'CW'
+    2      1     version          1
+    3      1     flags            予約 (0)
+    4      4     sequence         uint32 ランダムな値から始めて送信ごとに+1 (欠落・順序入れ替わりの検出用)
+    8      4     tick_index       uint32 スケジューラのtick番号
+    12     8     timestamp_us     uint64 送信側の単調時計 (time.monotonic_ns() // 1000)
+    20     4     tick_duration_us uint32 1tickの長さ
+    24     4     layout_id        uint32 カウンタの並び (TARGET_ALPHABETS) のCRC32
+    28     2     count            uint16 カウンタ数
+
+シーン制御パケット
+legacy: int32 の値のみ (4バイト、ネイティブエンディアン)
+v1:     magic b'CC' + version + flags + sequence (uint32) + value (int32)、リトルエンディアン。
+        同じ sequence で複数回再送されるので、受信側は sequence で重複を取り除く。
+"""
+import random
+import struct
+import time
+import zlib
+from collections import namedtuple
+
+LEGACY = 'legacy'
+V1 = 'v1'
+WIRE_FORMATS = (LEGACY, V1)
+
+MAGIC = b'CW'
+VERSION = 1
+HEADER = struct.Struct('<2sBBIIQIIH')
+
+CONTROL_MAGIC = b'CC'
+CONTROL_HEADER = struct.Struct('<2sBBIi')
+
+ControlPacket = namedtuple('ControlPacket', ['version', 'sequence', 'value'])
+
+Packet = namedtuple('Packet', [
+    'version', 'sequence', 'tick_index', 'timestamp_us', 'tick_duration_us', 'layout_id', 'counts',
+])
+
+
+def layout_id(alphabets):
+    """カウンタの並びを識別するID。TARGET_ALPHABETS が変わると値が変わる"""
+    return zlib.crc32(','.join(alphabets).encode('utf-8'))
+
+
+def encode_legacy(counts, tick_index=None):
+    """従来形式。tick_index を渡すと末尾に付加する"""
+    if tick_index is not None:
+        return struct.pack('i' * (len(counts) + 1), *counts, tick_index)
+    return struct.pack('i' * len(counts), *counts)
+
+
+def decode_legacy(data, stamped=False):
+    """従来形式をデコードして (counts, tick_index) を返す"""
+    if len(data) % 4:
+        raise ValueError(f"legacy packet length must be a multiple of 4, got {len(data)}")
+    values = list(struct.unpack('i' * (len(data) // 4), data))
+    if stamped:
+        return values[:-1], values[-1]
+    return values, None
+
+
+class PacketEncoder:
+    """v1形式のエンコーダ。送信ごとにシーケンス番号を進める
+
+    シーケンス番号はランダムな値から始めるので、送信側が再起動すると番号が大きく飛び、
+    受信側の SequenceTracker はそれを再起動として数え直す。
+    """
+
+    def __init__(self, alphabets, tick_duration):
+        self.layout_id = layout_id(alphabets)
+        self.tick_duration_us = int(round(tick_duration * 1_000_000))
+        self.sequence = random.getrandbits(32)
+
+    def encode(self, counts, tick_index):
+        header = HEADER.pack(
+            MAGIC, VERSION, 0,
+            self.sequence & 0xFFFFFFFF,
+            tick_index & 0xFFFFFFFF,
+            time.monotonic_ns() // 1000,
+            self.tick_duration_us,
+            self.layout_id,
+            len(counts),
+        )
+        self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+        return header + struct.pack(f'<{len(counts)}i', *counts)
+
+
+def decode(data):
+    """v1形式のパケットをデコードする。形式が不正なら ValueError"""
+    if len(data) < HEADER.size:
+        raise ValueError(f"packet too short: {len(data)} bytes")
+    magic, version, _flags, sequence, tick_index, timestamp_us, tick_duration_us, layout, count = \
+        HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(f"bad magic: {magic!r}")
+    if version != VERSION:
+        raise ValueError(f"unsupported version: {version}")
+    expected = HEADER.size + count * 4
+    if len(data) != expected:
+        raise ValueError(f"packet length {len(data)} does not match count {count} (expected {expected})")
+    counts = list(struct.unpack_from(f'<{count}i', data, HEADER.size))
+    return Packet(version, sequence, tick_index, timestamp_us, tick_duration_us, layout, counts)
+
+
+def encode_control(value, sequence=None):
+    """シーン制御パケット。sequence を省略すると legacy 形式 (値のみ)"""
+    if sequence is None:
+        return struct.pack('i', value)
+    return CONTROL_HEADER.pack(CONTROL_MAGIC, VERSION, 0, sequence & 0xFFFFFFFF, value)
+
+
+def decode_control(data):
+    """シーン制御パケットをデコードする。legacy 形式の場合 version と sequence は None"""
+    if len(data) == 4:
+        return ControlPacket(None, None, struct.unpack('i', data)[0])
+    if len(data) != CONTROL_HEADER.size:
+        raise ValueError(f"unexpected control packet length: {len(data)}")
+    magic, version, _flags, sequence, value = CONTROL_HEADER.unpack(data)
+    if magic != CONTROL_MAGIC:
+        raise ValueError(f"bad magic: {magic!r}")
+    if version != VERSION:
+        raise ValueError(f"unsupported version: {version}")
+    return ControlPacket(version, sequence, value)
+
+
+class SequenceTracker:
+    """受信側でシーケンス番号から欠落・順序入れ替わり・重複を数える
+
+    欠落として数えた番号は直近 window 個分まで覚えておき、遅れて届いたものだけを取り消す。
+    番号は uint32 の折り返しをまたいで連続した値として扱う。前後どちらかに window より大きく
+    飛んだ場合は、送信側の再起動 (ランダムな番号から始め直す) とみなして数え直す。
+    """
+
+    def __init__(self, window=1024):
+        self.window = window
+        self.highest = None
+        self.received = 0
+        self.lost = 0
+        self.reordered = 0
+        self.duplicates = 0
+        self.restarts = 0
+        self._seen_recent = set()
+        self._missing = set()
+
+    def record(self, sequence):
+        self.received += 1
+        if self.highest is not None:
+            # 直前の最大値からの差 (uint32 の折り返しを考慮した符号付きの値)
+            delta = (sequence - self.highest + 0x80000000) % 0x100000000 - 0x80000000
+            if abs(delta) > self.window:
+                self.restarts += 1
+                self.highest = None
+                self._seen_recent.clear()
+                self._missing.clear()
+            else:
+                sequence = self.highest + delta
+        if self.highest is None:
+            self.highest = sequence
+        elif sequence > self.highest:
+            # 飛んだ分はひとまず欠落として数え、遅れて届いたら取り消す
+            self.lost += sequence - self.highest - 1
+            self._missing.update(range(max(self.highest + 1, sequence - self.window), sequence))
+            self.highest = sequence
+        elif sequence in self._seen_recent:
+            self.duplicates += 1
+            return
+        else:
+            self.reordered += 1
+            if sequence in self._missing:
+                self._missing.discard(sequence)
+                self.lost -= 1
+        self._seen_recent.add(sequence)
+        if len(self._seen_recent) > 4 * self.window:
+            # 古いシーケンス番号は忘れる
+            floor = self.highest - self.window
+            self._seen_recent = {s for s in self._seen_recent if s > floor}
+            self._missing = {s for s in self._missing if s > floor}
+
+    def stats(self):
+        return {
+            "received": self.received,
+            "lost": self.lost,
+            "reordered": self.reordered,
+            "duplicates": self.duplicates,
+            "restarts": self.restarts,
+        }
@@ -0,0 +1,196 @@
+"""Unity の代わりにUDPを受けて内容と到着間隔を検証するツール
+
+    python udp_receiver.py --duration 60 --expect summary.json
+
+カウントパケット (既定 5005番) とシーン制御パケット (既定 3003番) を受信してデコードし、
+到着間隔のジッタ・途切れ・レターごとの合計を表示する。--expect に load_generator.py の
+--summary-out を渡すと、送り込んだ期待カウントと受信した合計を照合する。
+
+送信側はカウントが全て0のtickを送らないため、legacy形式では途切れ (gap) が
+必ずしも欠落を意味しない。v1形式ではシーケンス番号から欠落を数える。
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from collections import Counter
+
+import udp_protocol
+from classifier import TARGET_ALPHABETS
+
+
+class CountsReceiver(asyncio.DatagramProtocol):
+    """カウントパケットを受信して記録する"""
+
+    def __init__(self, stamped=False, tick_rate=1.0):
+        self.stamped = stamped
+        self.period = 1.0 / tick_rate
+        self.arrivals = []
+        self.totals = Counter()
+        self.tracker = udp_protocol.SequenceTracker()
+        self.formats = Counter()
+        self.errors = Counter()
+        self.latencies_us = []
+        self.layout_ids = set()
+        self.expected_layout = udp_protocol.layout_id(TARGET_ALPHABETS)
+
+    def datagram_received(self, data, addr):
+        arrived = time.monotonic()
+        if data[:2] == udp_protocol.MAGIC:
+            try:
+                packet = udp_protocol.decode(data)
+            except ValueError as e:
+                self.errors[str(e)] += 1
+                return
+            self.formats['v1'] += 1
+            self.tracker.record(packet.sequence)
+            self.period = packet.tick_duration_us / 1_000_000
+            self.layout_ids.add(packet.layout_id)
+            # 送信側の単調時計との差 (同じホストで動かしたときのみ意味がある)
+            self.latencies_us.append(time.monotonic_ns() // 1000 - packet.timestamp_us)
+            counts = packet.counts
+        else:
+            try:
+                counts, _tick_index = udp_protocol.decode_legacy(data, self.stamped)
+            except ValueError as e:
+                self.errors[str(e)] += 1
+                return
+            self.formats['legacy'] += 1
+        self.arrivals.append(arrived)
+        for letter, count in zip(TARGET_ALPHABETS, counts):
+            self.totals[letter] += count
+        if len(counts) != len(TARGET_ALPHABETS):
+            self.errors[f"counter count {len(counts)} != {len(TARGET_ALPHABETS)}"] += 1
+
+    def report(self):
+        intervals = [b - a for a, b in zip(self.arrivals, self.arrivals[1:])]
+        result = {
+            "packets": len(self.arrivals),
+            "formats": dict(self.formats),
+            "errors": dict(self.errors),
+            "totals": {letter: self.totals[letter] for letter in TARGET_ALPHABETS},
+            "period_ms": round(self.period * 1000, 3),
+        }
+        if intervals:
+            # 周期からのずれ (ジッタ) と、周期の1.5倍を超えた途切れ
+            deviations = [abs(i - self.period) for i in intervals]
+            result["interval_ms"] = {
+                "mean": round(statistics.fmean(intervals) * 1000, 3),
+                "stdev": round(statistics.pstdev(intervals) * 1000, 3),
+                "min": round(min(intervals) * 1000, 3),
+                "max": round(max(intervals) * 1000, 3),
+            }
+            result["jitter_ms"] = {
+                "mean": round(statistics.fmean(deviations) * 1000, 3),
+                "max": round(max(deviations) * 1000, 3),
+            }
+            result["gaps"] = sum(1 for i in intervals if i > self.period * 1.5)
+        if self.formats['v1']:
+            result["sequence"] = self.tracker.stats()
+            result["layout_mismatch"] = any(i != self.expected_layout for i in self.layout_ids)
+        if self.latencies_us:
+            latencies = sorted(self.latencies_us)
+            result["same_host_latency_ms"] = {
+                "p50": round(latencies[len(latencies) // 2] / 1000, 3),
+                "max": round(latencies[-1] / 1000, 3),
+            }
+        return result
+
+
+class ControlReceiver(asyncio.DatagramProtocol):
+    """シーン制御パケットを受信し、v1形式ではシーケンス番号で重複を取り除く"""
+
+    def __init__(self):
+        self.received = 0
+        self.duplicates = 0
+        self.values = Counter()
+        self.errors = 0
+        self._seen = set()
+
+    def datagram_received(self, data, addr):
+        self.received += 1
+        try:
+            packet = udp_protocol.decode_control(data)
+        except ValueError:
+            self.errors += 1
+            return
+        if packet.sequence is not None:
+            if packet.sequence in self._seen:
+                self.duplicates += 1
+                return
+            self._seen.add(packet.sequence)
+        self.values[packet.value] += 1
+        print(f"[control] value={packet.value} sequence={packet.sequence}")
+
+    def report(self):
+        return {
+            "received": self.received,
+            "duplicates": self.duplicates,
+            "errors": self.errors,
+            "values": dict(self.values),
+        }
+
+
+def compare(totals, expected):
+    """受信した合計と期待カウントの差 (受信 - 期待) を返す"""
+    return {letter: totals.get(letter, 0) - expected.get(letter, 0) for letter in TARGET_ALPHABETS}
+
+
+def print_report(counts, control, expected=None):
+    report = {"counts": counts.report(), "control": control.report()}
+    if expected is not None:
+        diff = compare(report["counts"]["totals"], expected)
+        report["cross_check"] = {
+            "matched": not any(diff.values()),
+            "received_minus_expected": diff,
+        }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return report
+
+
+async def run(args):
+    loop = asyncio.get_running_loop()
+    counts = CountsReceiver(args.stamped, args.tick_rate)
+    control = ControlReceiver()
+    counts_transport, _ = await loop.create_datagram_endpoint(lambda: counts, local_addr=(args.host, args.port))
+    control_transport, _ = await loop.create_datagram_endpoint(
+        lambda: control, local_addr=(args.host, args.control_port))
+    print(f"Listening for counts on {args.host}:{args.port}, control on {args.host}:{args.control_port}...")
+
+    expected = None
+    if args.expect:
+        with open(args.expect, encoding='utf-8') as f:
+            expected = json.load(f)["expected_counts"]
+
+    try:
+        start = loop.time()
+        while args.duration is None or loop.time() - start < args.duration:
+            await asyncio.sleep(args.report_interval)
+            print(f"[counts] packets={len(counts.arrivals)} totals={dict(counts.totals)}")
+    except asyncio.CancelledError:
+        pass
+    finally:
+        counts_transport.close()
+        control_transport.close()
+    return print_report(counts, control, expected)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Unity UDP receiver")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5005, help="カウントパケットの受信ポート")
+    parser.add_argument('--control-port', type=int, default=3003, help="シーン制御パケットの受信ポート")
+    parser.add_argument('--tick-rate', type=float, default=1.0, help="legacy形式のときの想定tickレート (Hz)")
+    parser.add_argument('--stamped', action='store_true', help="legacy形式の末尾にtick番号が付いている (--stamp-tick)")
+    parser.add_argument('--duration', type=float, help="受信する秒数 (省略時は Ctrl-C まで)")
+    parser.add_argument('--report-interval', type=float, default=5.0)
+    parser.add_argument('--expect', help="load_generator.py --summary-out のJSON")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(run(parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -8,6 +8,9 @@ import GraphemeSplitter from 'grapheme-splitter';
 interface ReceivedMessage {
   text: string;
   timestamp: string;
+  // サーバー側の判定結果 (emoji / text / blocked)。古いサーバーでは付かない
+  kind?: 'emoji' | 'text' | 'blocked';
+  reason?: string;
 }
 
 interface EmojiDisplay {
@@ -292,16 +295,39 @@ function App() {
   // SSE接続とメッセージ受信 (isEmoji関数の修正を含む)
   useEffect(() => {
     console.log('Setting up EventSource...');
-    let eventSource = new EventSource('/sse');
+    let eventSource: EventSource;
+    let reconnectTimer: ReturnType<typeof setTimeout> | null = null;
+    // 最後に受け取ったイベントID (作り直した EventSource でも取りこぼし分を送り直してもらう)
+    let lastEventId = '';
 
-    eventSource.onopen = () => console.log('SSE connection opened');
-
-    eventSource.onmessage = (event) => {
+    const handleMessage = (event: MessageEvent) => {
+      if (event.lastEventId) lastEventId = event.lastEventId;
       try {
         // console.log('[SSE] Raw data received:', event.data); // デバッグ用
-        const messageData = JSON.parse(event.data);
+        const messageData: ReceivedMessage = JSON.parse(event.data);
         // console.log('[SSE] Parsed message text:', messageData.text); // デバッグ用
 
+        const addReceivedMessage = () => {
+          setReceivedMessages(prevMessages => {
+            const updatedMessages = [messageData, ...prevMessages];
+            return updatedMessages.slice(0, 10); // 最新10件のみ保持
+          });
+        };
+
+        // サーバーで判定済みの場合はその結果に従い、ここでの判定は行わない
+        if (messageData.kind === 'blocked') {
+          console.log(`[SSE] Blocked by server (${messageData.reason}):`, messageData.text);
+          return;
+        }
+        if (messageData.kind === 'emoji') {
+          enqueueEmoji(messageData.text);
+          return;
+        }
+        if (messageData.kind === 'text') {
+          addReceivedMessage();
+          return;
+        }
+
         const splitter = new GraphemeSplitter();
         const graphemes = splitter.splitGraphemes(messageData.text);
         // console.log('[SSE] Graphemes:', graphemes); // デバッグ用
@@ -361,30 +387,35 @@ function App() {
         } else {
           // 通常メッセージ処理
           // console.log('[SSE] Adding non-emoji-only message to list:', messageData.text); // デバッグ用
-          setReceivedMessages(prevMessages => {
-            const updatedMessages = [messageData, ...prevMessages];
-            return updatedMessages.slice(0, 10); // 最新10件のみ保持
-          });
+          addReceivedMessage();
         }
       } catch (error) {
         console.error('Failed to parse SSE message data:', error, event.data);
       }
     };
 
-    eventSource.onerror = (error) => {
-      console.error('EventSource failed:', error);
-      eventSource.close(); // エラー時は一旦閉じる
-      // 再接続ロジック (例: 3秒後)
-      setTimeout(() => {
-        console.log('Attempting to reconnect SSE...');
-        // 再接続処理をここに実装 (このuseEffectが再実行されるようにするか、別の方法で)
-        // この例では単純化のため、再接続ロジックは省略
-      }, 3000);
+    const connect = () => {
+      const url = lastEventId ? `/sse?last_event_id=${encodeURIComponent(lastEventId)}` : '/sse';
+      eventSource = new EventSource(url);
+      eventSource.onopen = () => console.log('SSE connection opened');
+      eventSource.onmessage = handleMessage;
+      eventSource.onerror = (error) => {
+        console.error('EventSource failed:', error);
+        // 接続中 (CONNECTING) ならブラウザが Last-Event-ID を付けて自動で再接続する
+        if (eventSource.readyState !== EventSource.CLOSED) return;
+        // 閉じられてしまった場合は3秒後に作り直す
+        reconnectTimer = setTimeout(() => {
+          console.log('Attempting to reconnect SSE...');
+          connect();
+        }, 3000);
+      };
     };
+    connect();
 
     // クリーンアップ関数
     return () => {
       console.log('Closing EventSource connection');
+      if (reconnectTimer) clearTimeout(reconnectTimer);
       eventSource.close();
       // ★ コンポーネントアンマウント時にタイマーをクリア
       if (throttleTimerRef.current) {